@@ -0,0 +1,245 @@
+__author__ = 'Maksymilian Mika'
+
+import argparse
+import array
+import mmap
+import struct
+import sys
+import time
+import Chess
+import Pgn
+
+magic = b"CHESSARC"
+# Magic, number of games and offset of the index table.
+header_format = struct.Struct("<8sQQ")
+# Offset of the first move, number of plies, result and the packed starting position of one game.
+index_format = struct.Struct("<QIB34sx")
+results = ["*", "1-0", "0-1", "1/2-1/2"]
+
+
+class ArchiveWriter:
+    def __init__(self, path):
+        """
+        Write games into a new archive file. The moves are written as they come, the index when the archive is
+        closed. Layout of the file: header, 16 bit little endian move codes of all games one after another, index
+        with one fixed size entry per game.
+        :param path: Path of the file, it is overwritten.
+        """
+        self.file = open(path, "wb")
+        self.file.write(header_format.pack(magic, 0, 0))
+        self.offset = header_format.size
+        self.index = bytearray()
+        self.count = 0
+
+    def add_codes(self, codes, start=None, result="*"):
+        """
+        Add a game given as encoded moves.
+        :param codes: Moves encoded as by Board.move_code.
+        :param start: Starting position as Board or bytes from Board.to_bytes, the usual one when not given.
+        :param result: Result of the game. Example: 1-0
+        """
+        if start is None:
+            start = Chess.Board()
+        if isinstance(start, Chess.Board):
+            start = start.to_bytes()
+        moves = array.array("H", codes)
+        if sys.byteorder == "big":
+            moves.byteswap()
+        self.file.write(moves.tobytes())
+        self.index += index_format.pack(self.offset, len(moves), results.index(result), start)
+        self.offset += 2 * len(moves)
+        self.count += 1
+
+    def add_game(self, moves, start=None, result="*"):
+        """
+        Add a game given as moves of Board.make_move. The moves are played to find their flags.
+        :param moves: Legal moves of the game.
+        :param start: Starting position, the usual one when not given. It is left unchanged.
+        """
+        if start is None:
+            board = Chess.Board()
+        else:
+            board = start.copy()
+        snapshot = board.to_bytes()
+        codes = []
+        for move in moves:
+            codes.append(board.move_code(move))
+            board.make_move(*move)
+        self.add_codes(codes, snapshot, result)
+
+    def close(self):
+        """
+        Write the index and the header.
+        """
+        self.file.write(self.index)
+        self.file.seek(0)
+        self.file.write(header_format.pack(magic, self.count, self.offset))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class Archive:
+    def __init__(self, path):
+        """
+        Open an archive for reading. The file is memory mapped, so nothing is read until it is used and processes
+        opening the same file share its pages.
+        :param path: Path of the file written by ArchiveWriter.
+        """
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        found, self.count, self.index_offset = header_format.unpack_from(self.map, 0)
+        if found != magic or self.index_offset + self.count * index_format.size > len(self.map):
+            self.map.close()
+            raise ValueError("Not a game archive: " + path)
+        self.view = memoryview(self.map)
+
+    def __len__(self):
+        return self.count
+
+    def entry(self, number):
+        """
+        Read the index entry of the game.
+        :param number: Number of the game counted from 0.
+        :return: Tuple (offset, plies, result index, starting position bytes).
+        """
+        if not 0 <= number < self.count:
+            raise IndexError("No game " + str(number))
+        return index_format.unpack_from(self.map, self.index_offset + number * index_format.size)
+
+    def moves(self, number):
+        """
+        Moves of the game without copying them out of the file.
+        :return: Sequence of move codes. Release it (or let it go) before closing the archive.
+        """
+        offset, plies, result, start = self.entry(number)
+        moves = self.view[offset:offset + 2 * plies].cast("H")
+        if sys.byteorder == "big":
+            moves = array.array("H", moves)
+            moves.byteswap()
+        return moves
+
+    def move(self, number, ply):
+        """
+        :param ply: Ply of the game counted from 0.
+        :return: Code of one move of the game.
+        """
+        offset, plies, result, start = self.entry(number)
+        if not 0 <= ply < plies:
+            raise IndexError("No ply " + str(ply) + " in game " + str(number))
+        return struct.unpack_from("<H", self.map, offset + 2 * ply)[0]
+
+    def result(self, number):
+        """
+        :return: Result of the game. Example: 1-0
+        """
+        return results[self.entry(number)[2]]
+
+    def start(self, number):
+        """
+        :return: New board with the starting position of the game.
+        """
+        return Chess.Board.from_bytes(self.entry(number)[3])
+
+    def replay(self, number, plies=None):
+        """
+        Play the game up to the given ply.
+        :param plies: Number of moves to play, all when not given.
+        :return: New board with the position.
+        """
+        board = self.start(number)
+        moves = self.moves(number)
+        if plies is None:
+            plies = len(moves)
+        for ply in range(plies):
+            board.make_encoded_move(moves[ply])
+        return board
+
+    def games(self):
+        """
+        Go through all the games in the order they were written.
+        :return: Generator of triples (number, moves as from the moves method, result).
+        """
+        for number in range(self.count):
+            yield number, self.moves(number), self.result(number)
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create a binary game archive from PGN files or read one.")
+    parser.add_argument("archive", help="archive file")
+    parser.add_argument("--pgn", nargs="+", default=None, help="PGN files to replay into a new archive")
+    parser.add_argument("--processes", type=int, default=None, help="number of worker processes replaying PGN")
+    parser.add_argument("--game", type=int, default=None, help="print the moves and position of this game")
+    parser.add_argument("--ply", type=int, default=None, help="ply of the game to show the position after")
+    args = parser.parse_args()
+
+    if args.pgn is not None:
+        def texts():
+            for name in args.pgn:
+                with open(name, buffering=1 << 20) as file:
+                    yield from Pgn.read_game_texts(file)
+
+        start = time.perf_counter()
+        invalid = 0
+        with ArchiveWriter(args.archive) as writer:
+            for number, report in Pgn.validate_games(texts(), args.processes):
+                if report["error"] is not None:
+                    invalid += 1
+                    print(str(number) + "\tinvalid\t" + report["error"], file=sys.stderr)
+                    continue
+                start_board = None
+                if report["tags"].get("SetUp") == "1" and "FEN" in report["tags"]:
+                    start_board = Chess.Board(report["tags"]["FEN"])
+                result = report["result"]
+                if result not in results:
+                    result = "*"
+                writer.add_codes(report["codes"], start_board, result)
+            count = writer.count
+        print(str(count) + " games written, " + str(invalid) + " invalid skipped in " +
+              "%.3f" % (time.perf_counter() - start) + "s", file=sys.stderr)
+        return
+
+    with Archive(args.archive) as archive:
+        if args.game is not None:
+            moves = archive.moves(args.game)
+            board = archive.start(args.game)
+            names = []
+            for code in moves:
+                names.append(Pgn.move_san(board, Chess.decode_move(code)))
+                board.make_encoded_move(code)
+            print(" ".join(names) + " " + archive.result(args.game))
+            print(archive.replay(args.game, args.ply).fen())
+            del moves
+            return
+        start = time.perf_counter()
+        plies = 0
+        moves = None
+        for number, moves, result in archive.games():
+            board = archive.start(number)
+            for code in moves:
+                board.make_encoded_move(code)
+            plies += len(moves)
+        del moves
+        elapsed = time.perf_counter() - start
+        print(str(len(archive)) + " games, " + str(plies) + " plies replayed in " + "%.3f" % elapsed + "s (" +
+              str(int(plies / max(elapsed, 1e-9))) + " plies/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+__author__ = 'Maksymilian Mika'
+
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+import Chess
+
+# Positions every benchmark runs on, chosen to stress different parts of move generation.
+fixture_positions = {
+    "opening": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "middlegame": "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "endgame": "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+    "castling": "r3k2r/pppppppp/8/8/8/8/PPPPPPPP/R3K2R w KQkq - 0 1",
+    "promotion": "n1n5/PPPk4/8/8/8/8/4Kppp/5N1N b - - 0 1",
+}
+
+
+def board_benchmarks(name, fen):
+    """
+    Create the benchmarks of one fixture position.
+    :return: List of pairs (benchmark name, function without arguments).
+    """
+    board = Chess.Board(fen)
+    own = [Chess.convert_index(index) for index in Chess.iterate_bits(board.occupied[board.turn])]
+    fields = [Chess.convert_index(index) for index in range(64)]
+    legal = board.legal_moves()
+
+    def possible_moves():
+        for point in own:
+            board.possible_moves(point)
+
+    def is_checked():
+        for point in fields:
+            board.is_checked(point)
+
+    def make_move():
+        for move in legal:
+            board.unmake_move(board.make_move(*move))
+
+    def recalculate_moves():
+        board.moves_hash = None
+        board.recalculate_moves()
+
+    def get_moves():
+        board.moves_hash = None
+        for point in fields:
+            board.get_moves(point)
+
+    def see():
+        for move in legal:
+            board.see(move)
+
+    return [("possible_moves/" + name, possible_moves), ("is_checked/" + name, is_checked),
+            ("make_move/" + name, make_move), ("recalculate_moves/" + name, recalculate_moves),
+            ("get_moves/" + name, get_moves), ("see/" + name, see)]
+
+
+def display_benchmarks():
+    """
+    Create benchmarks of drawing the board with a dummy video driver.
+    :return: List of pairs (benchmark name, function without arguments), empty when pygame is not installed.
+    """
+    try:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        import pygame
+        import Display
+    except ImportError:
+        return []
+    pygame.init()
+    screen = pygame.display.set_mode((8 * 60, 8 * 60))
+    board_display = Display.BoardDisplay()
+    board_display.close()
+
+    def full_frame():
+        board_display.invalidate()
+        board_display.display(screen)
+
+    def idle_frame():
+        board_display.display(screen)
+
+    return [("display/full_frame", full_frame), ("display/idle_frame", idle_frame)]
+
+
+def run_benchmarks(repeat=5, selected=None):
+    """
+    Time all benchmarks. The move cache is turned off, so moves are generated every time.
+    :param repeat: Number of timings of every benchmark, the fastest is taken.
+    :param selected: Substring of the names of benchmarks to run, all when not given.
+    :return: Dictionary from benchmark name to seconds per call.
+    """
+    benchmarks = []
+    for name, fen in fixture_positions.items():
+        benchmarks += board_benchmarks(name, fen)
+    benchmarks += display_benchmarks()
+    cache = Chess.move_cache
+    Chess.move_cache = None
+    results = {}
+    try:
+        for name, function in benchmarks:
+            if selected is not None and selected not in name:
+                continue
+            timer = timeit.Timer(function)
+            number, elapsed = timer.autorange()
+            results[name] = min(timer.repeat(repeat, number)) / number
+    finally:
+        Chess.move_cache = cache
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare the results with a baseline.
+    :param threshold: Allowed slowdown. Example: 0.1 for 10%
+    :return: Pair (lines of the report, names of benchmarks slower than allowed).
+    """
+    lines = []
+    regressions = []
+    for name, seconds in results.items():
+        if name not in baseline:
+            lines.append("%-32s %12s %12.2f" % (name, "-", seconds * 1e6))
+            continue
+        change = seconds / baseline[name] - 1
+        mark = ""
+        if change > threshold:
+            mark = " regression"
+            regressions.append(name)
+        lines.append("%-32s %12.2f %12.2f %+8.1f%%%s" % (name, baseline[name] * 1e6, seconds * 1e6, change * 100, mark))
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time move generation and drawing, optionally against a baseline.")
+    parser.add_argument("--output", default=None, help="JSON file for the results, printed when not given")
+    parser.add_argument("--baseline", default=None, help="JSON file with earlier results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown against the baseline")
+    parser.add_argument("--repeat", type=int, default=5, help="timings of every benchmark, the fastest is kept")
+    parser.add_argument("--only", default=None, help="run only benchmarks with this in their name")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.repeat, args.only)
+    report = {"python": platform.python_version(), "machine": platform.machine(), "unit": "seconds per call",
+              "results": results}
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+        lines, regressions = compare(results, baseline, args.threshold)
+        print("%-32s %12s %12s %9s" % ("benchmark", "baseline us", "current us", "change"), file=sys.stderr)
+        for line in lines:
+            print(line, file=sys.stderr)
+        if regressions:
+            print(str(len(regressions)) + " benchmarks slower than the baseline by more than " +
+                  "%.0f" % (args.threshold * 100) + "%", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+__author__ = 'Maksymilian Mika'
+
+import argparse
+import mmap
+import random
+import struct
+import sys
+import time
+import Archive
+import Chess
+import Perft
+
+magic = b"CHESBOOK"
+# Magic and number of records.
+header_format = struct.Struct("<8sQ")
+# Position hash, move code and weight. Records are sorted by hash, moves of one position by weight.
+record_format = struct.Struct("<QHH")
+hash_format = struct.Struct("<Q")
+
+
+def build_book(path, games, plies=16, min_count=1):
+    """
+    Write an opening book from the moves played in the games.
+    :param path: Path of the book file, it is overwritten.
+    :param games: Iterable of pairs (starting board, move codes), for example from archive_games. The boards are
+    changed.
+    :param plies: Number of moves of every game that are added.
+    :param min_count: Moves played fewer times in a position are left out.
+    :return: Number of records written.
+    """
+    counts = {}
+    for board, codes in games:
+        for code in codes[:plies]:
+            key = (board.hash, code)
+            counts[key] = counts.get(key, 0) + 1
+            board.make_encoded_move(code)
+    records = []
+    for (position, code), count in counts.items():
+        if count >= min_count:
+            records.append((position, -count, code))
+    records.sort()
+    with open(path, "wb") as file:
+        file.write(header_format.pack(magic, len(records)))
+        for position, count, code in records:
+            file.write(record_format.pack(position, code, min(-count, 65535)))
+    return len(records)
+
+
+def archive_games(archive):
+    """
+    Games of an archive in the form build_book takes.
+    :param archive: Opened Archive.Archive.
+    :return: Generator of pairs (starting board, move codes).
+    """
+    for number in range(len(archive)):
+        yield archive.start(number), archive.moves(number).tolist()
+
+
+class Book:
+    def __init__(self, path):
+        """
+        Open an opening book. The file is memory mapped and searched in place, so opening it reads nothing and
+        processes using the same book share its pages.
+        :param path: Path of the file written by build_book.
+        """
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        found, self.count = header_format.unpack_from(self.map, 0)
+        if found != magic or header_format.size + self.count * record_format.size > len(self.map):
+            self.map.close()
+            raise ValueError("Not an opening book: " + path)
+
+    def __len__(self):
+        return self.count
+
+    def entries(self, position):
+        """
+        Find the records of the position by binary search.
+        :param position: Hash of the position, as Board.hash.
+        :return: List of pairs (move code, weight), the most played first.
+        """
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            if hash_format.unpack_from(self.map, header_format.size + middle * record_format.size)[0] < position:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        offset = header_format.size + low * record_format.size
+        for i in range(low, self.count):
+            found, code, weight = record_format.unpack_from(self.map, offset)
+            if found != position:
+                break
+            entries.append((code, weight))
+            offset += record_format.size
+        return entries
+
+    def lookup(self, board):
+        """
+        Find the book moves of the board. Moves that are not legal, which only happens when two positions share
+        a hash, are left out.
+        :return: List of pairs (move as used by Board.make_move, weight), the most played first.
+        """
+        moves = []
+        for code, weight in self.entries(board.hash):
+            move = Chess.decode_move(code)
+            if move in board.get_moves(move[0]):
+                moves.append((move, weight))
+        return moves
+
+    def choose(self, board, generator=random):
+        """
+        Pick a book move at random, more played moves more often.
+        :param generator: Source of randomness, the random module when not given.
+        :return: Move as used by Board.make_move or None when the position is not in the book.
+        """
+        moves = self.lookup(board)
+        if not moves:
+            return None
+        return generator.choices([move for move, weight in moves], [weight for move, weight in moves])[0]
+
+    def close(self):
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an opening book from a game archive or look positions up.")
+    parser.add_argument("book", help="book file")
+    parser.add_argument("--archive", default=None, help="game archive to build the book from")
+    parser.add_argument("--plies", type=int, default=16, help="moves of every game added to the book")
+    parser.add_argument("--min-count", type=int, default=1, help="least times a move has to be played")
+    parser.add_argument("--fen", default=None, help="position to look up, the starting position when not given")
+    args = parser.parse_args()
+
+    if args.archive is not None:
+        start = time.perf_counter()
+        with Archive.Archive(args.archive) as archive:
+            records = build_book(args.book, archive_games(archive), args.plies, args.min_count)
+        print(str(records) + " records written in " + "%.3f" % (time.perf_counter() - start) + "s", file=sys.stderr)
+        return
+
+    board = Chess.Board(args.fen)
+    with Book(args.book) as book:
+        start = time.perf_counter()
+        moves = book.lookup(board)
+        elapsed = time.perf_counter() - start
+        for move, weight in moves:
+            print(Perft.move_name(move) + "\t" + str(weight))
+        print(str(len(moves)) + " moves among " + str(len(book)) + " records found in " + "%.1f" % (elapsed * 1e6) +
+              "us", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 __author__ = 'Maksymilian Mika'
 
-import copy
+import array
+import collections
+import random
 
 
 class Piece:
@@ -45,6 +47,10 @@ black_bishop = Piece("Bishop", "Black", bishop_directions, True)
 black_queen = Piece("Queen", "Black", queen_directions, True)
 black_king = Piece("King", "Black", king_directions, False)
 
+fen_pieces = {"P": white_pawn, "R": white_rook, "N": white_knight, "B": white_bishop, "Q": white_queen,
+              "K": white_king, "p": black_pawn, "r": black_rook, "n": black_knight, "b": black_bishop,
+              "q": black_queen, "k": black_king}
+
 
 def opposite_color(color):
     """
@@ -130,10 +136,265 @@ def add_vectors(v, dv):
     return x + dx, y + dy
 
 
+# Bitboards: bit number i corresponds to the field with index i in the table.
+full_mask = (1 << 64) - 1
+file_a = 0x0101010101010101
+file_b = file_a << 1
+file_g = file_a << 6
+file_h = file_a << 7
+rank_masks = [0xFF << (8 * y) for y in range(8)]
+
+# Masks applied after a horizontal shift so pieces do not wrap around the board.
+wrap_masks = {0: full_mask,
+              1: full_mask ^ file_a,
+              2: full_mask ^ file_a ^ file_b,
+              -1: full_mask ^ file_h,
+              -2: full_mask ^ file_g ^ file_h}
+
+pieces = [white_pawn, white_knight, white_bishop, white_rook, white_queen, white_king,
+          black_pawn, black_knight, black_bishop, black_rook, black_queen, black_king]
+for piece_index, piece in enumerate(pieces):
+    piece.index = piece_index
+# Field contents by the 4 bit codes of Board.to_bytes and the other way round.
+code_pieces = [None] + pieces
+field_codes = {None: 0}
+for piece in pieces:
+    field_codes[piece] = piece.index + 1
+# Codes of both fields packed into every byte value.
+byte_codes = [(byte & 15, byte >> 4) for byte in range(256)]
+
+
+# Zobrist keys. The hash of a position is the xor of the keys of everything in it.
+zobrist_random = random.Random(20160101)
+zobrist_pieces = [[zobrist_random.getrandbits(64) for index in range(64)] for piece in pieces]
+zobrist_black_turn = zobrist_random.getrandbits(64)
+# Indexed with the en passant file, the last entry (index -1) is used when there is no en passant.
+zobrist_en_passant = [zobrist_random.getrandbits(64) for x in range(8)] + [0]
+castle_keys = [zobrist_random.getrandbits(64) for i in range(4)]
+# Key for every combination of (white_castle, black_castle).
+castle_rights = [(False, False), (False, True), (True, False), (True, True)]
+zobrist_castle = {}
+for white_castle in castle_rights:
+    for black_castle in castle_rights:
+        key = 0
+        for right, castle_key in zip(white_castle + black_castle, castle_keys):
+            if right:
+                key ^= castle_key
+        zobrist_castle[(white_castle, black_castle)] = key
+
+
+def iterate_bits(bitboard):
+    """
+    Iterate over the set bits of a bitboard.
+    :param bitboard: 64 bit integer.
+    :return: Generator of indexes of the set bits, lowest first.
+    """
+    while bitboard:
+        low = bitboard & -bitboard
+        yield low.bit_length() - 1
+        bitboard ^= low
+
+
+# For every direction: how far the bits move and which fields they may land on.
+# Shifting left is done on the mask first, so the result never grows past 64 bits.
+shifts = {}
+for dx in range(-2, 3):
+    for dy in range(-2, 3):
+        amount = dx + dy * 8
+        if amount > 0:
+            shifts[(dx, dy)] = (amount, wrap_masks[dx] >> amount)
+        else:
+            shifts[(dx, dy)] = (-amount, wrap_masks[dx] << -amount)
+
+
+def shift(bitboard, direction):
+    """
+    Move every set bit of the bitboard by given vector. Bits leaving the board are dropped.
+    :param direction: Vector to move by. Example: (1, 2)
+    :return: Shifted bitboard.
+    """
+    amount, mask = shifts[direction]
+    if direction[0] + direction[1] * 8 > 0:
+        return (bitboard & mask) << amount
+    return (bitboard & mask) >> amount
+
+
+def step_attacks(bitboard, directions):
+    """
+    Fields attacked by non sliding pieces standing on the bitboard.
+    :return: Bitboard of attacked fields.
+    """
+    attacks = 0
+    for direction in directions:
+        amount, mask = shifts[direction]
+        if direction[0] + direction[1] * 8 > 0:
+            attacks |= (bitboard & mask) << amount
+        else:
+            attacks |= (bitboard & mask) >> amount
+    return attacks
+
+
+def slide_attacks(bitboard, directions, occupied):
+    """
+    Fields attacked by sliding pieces standing on the bitboard. Sliding stops on the first occupied field.
+    :param occupied: Bitboard of all occupied fields.
+    :return: Bitboard of attacked fields.
+    """
+    attacks = 0
+    for direction in directions:
+        amount, mask = shifts[direction]
+        current = bitboard
+        if direction[0] + direction[1] * 8 > 0:
+            current = (current & mask) << amount
+            while current:
+                attacks |= current
+                current = (current & mask & ~occupied) << amount
+        else:
+            current = (current & mask) >> amount
+            while current:
+                attacks |= current
+                current = (current & mask & ~occupied) >> amount
+    return attacks
+
+
+# Attack tables calculated once for every field.
+knight_attacks = [step_attacks(1 << index, knight_directions) for index in range(64)]
+king_attacks = [step_attacks(1 << index, king_directions) for index in range(64)]
+pawn_attacks = {"White": [step_attacks(1 << index, [(-1, 1), (1, 1)]) for index in range(64)],
+                "Black": [step_attacks(1 << index, [(-1, -1), (1, -1)]) for index in range(64)]}
+# For every direction: fields on the ray from each field on an empty board and if the ray goes to higher indexes.
+rays = {}
+for direction in queen_directions:
+    rays[direction] = ([slide_attacks(1 << index, [direction], 0) for index in range(64)],
+                       direction[0] + direction[1] * 8 > 0)
+rook_lines = [slide_attacks(1 << index, rook_directions, 0) for index in range(64)]
+bishop_lines = [slide_attacks(1 << index, bishop_directions, 0) for index in range(64)]
+
+
+def ray_attacks(index, directions, occupied):
+    """
+    Fields attacked by a sliding piece, using the precalculated rays. Each ray is cut behind its first blocker.
+    :param index: Index of the field of the piece.
+    :param occupied: Bitboard of all occupied fields.
+    :return: Bitboard of attacked fields.
+    """
+    attacks = 0
+    for direction in directions:
+        table, positive = rays[direction]
+        ray = table[index]
+        blockers = ray & occupied
+        if blockers:
+            if positive:
+                ray ^= table[(blockers & -blockers).bit_length() - 1]
+            else:
+                ray ^= table[blockers.bit_length() - 1]
+        attacks |= ray
+    return attacks
+
+
+# Values of the pieces in static exchange evaluation, by piece index % 6. The king is worth more than anything it
+# could win.
+exchange_values = [100, 320, 330, 500, 900, 20000]
+
+# Moves packed into 16 bits: index of the starting field (bits 0-5), index of the target field (bits 6-11) and
+# flags (bits 12-15). Promotions set promotion_flag and choose the piece from promotion_pieces with the two lowest
+# flag bits.
+castle_flag = 1
+en_passant_flag = 2
+promotion_flag = 8
+promotion_pieces = ["Knight", "Bishop", "Rook", "Queen"]
+max_moves = 256  # No position has more than 218 legal moves.
+index_points = [convert_index(index) for index in range(64)]
+
+
+def encode_move(move, flags=0):
+    """
+    Pack a move in the tuple form into 16 bits.
+    :param move: Move. Example: ((4, 6), (4, 7), "Queen")
+    :param flags: Castle or en passant flag, they can not be told from the tuple alone.
+    :return: Encoded move.
+    """
+    code = convert_point(move[0]) | convert_point(move[1]) << 6 | flags << 12
+    if len(move) == 3:
+        code |= (promotion_flag | promotion_pieces.index(move[2])) << 12
+    return code
+
+
+def decode_move(code):
+    """
+    Unpack a 16 bit move into the tuple form.
+    :param code: Encoded move.
+    :return: Move as used by make_move and get_moves.
+    """
+    flags = code >> 12
+    if flags & promotion_flag:
+        return index_points[code & 63], index_points[code >> 6 & 63], promotion_pieces[flags & 3]
+    return index_points[code & 63], index_points[code >> 6 & 63]
+
+
+def move_buffer():
+    """
+    Create a buffer big enough for the moves of any position, to be filled by Board.generate_moves.
+    :return: Array of max_moves 16 bit integers.
+    """
+    return array.array("H", bytes(2 * max_moves))
+
+
+class MoveCache:
+    def __init__(self, max_entries=4096):
+        """
+        Cache of legal moves of already seen positions, keyed by their hash. When it gets full the least recently
+        used position is dropped. One position takes roughly 5 kB, mostly for the 64 move lists.
+        :param max_entries: Maximal number of remembered positions.
+        """
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Look up the moves of a position.
+        :param key: Hash of the position.
+        :return: Moves stored for the position or None if there are none.
+        """
+        moves = self.entries.get(key)
+        if moves is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return moves
+
+    def put(self, key, moves):
+        """
+        Remember the moves of a position, dropping the least recently used ones above the limit.
+        :param key: Hash of the position.
+        :param moves: Moves from every field of the position, as stored in Board.moves.
+        """
+        self.entries[key] = moves
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Forget all positions and reset the counters.
+        """
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# Shared by all boards. Set to None to always generate the moves.
+move_cache = MoveCache()
+
+
 class Board:
-    def __init__(self):
+    def __init__(self, fen=None):
         """
         Initial setting of the board.
+        :param fen: Optional FEN description of the position to start from instead.
         """
         self.table = [white_rook, white_knight, white_bishop, white_queen, white_king, white_bishop, white_knight,
                       white_rook]
@@ -153,7 +414,14 @@ class Board:
         self.moves = []
         for i in range(64):
             self.moves.append([])
+        # Hash of the position self.moves belongs to, and its check_info once calculated.
+        self.moves_hash = None
+        self.info = None
         self.win = None
+        self.calculate_bitboards()
+        self.calculate_hash()
+        if fen is not None:
+            self.set_fen(fen)
 
     def __str__(self):
         string = "  0  1  2  3  4  5  6  7 \n"
@@ -168,40 +436,340 @@ class Board:
             string += "\n"
         return string
 
-    def is_checked(self, point):
+    def set_fen(self, fen):
         """
-        Check if given point is checked by the opposite color.
-        :param point: Point to check.
-        :return: True if the point is checked. False otherwise.
+        Set up the position from FEN description. Move counters are ignored.
+        :param fen: Example: rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1
         """
+        fields = fen.split()
+        if not fields:
+            raise ValueError("Invalid FEN: " + fen)
+        rows = fields[0].split("/")
+        if len(rows) != 8:
+            raise ValueError("Invalid FEN: " + fen)
+        table = [None] * 64
+        for y, row in enumerate(reversed(rows)):
+            x = 0
+            for char in row:
+                if char.isdigit():
+                    x += int(char)
+                elif char in fen_pieces and x < 8:
+                    table[convert_point((x, y))] = fen_pieces[char]
+                    x += 1
+                else:
+                    raise ValueError("Invalid FEN: " + fen)
+            if x != 8:
+                raise ValueError("Invalid FEN: " + fen)
+        if table.count(white_king) != 1 or table.count(black_king) != 1:
+            raise ValueError("Invalid FEN, every side needs one king: " + fen)
+        fields += ["w", "-", "-"][len(fields) - 1:]
+        if fields[1] not in ("w", "b"):
+            raise ValueError("Invalid FEN, the side to move is w or b: " + fen)
+        if fields[1] == "w":
+            turn = "White"
+        else:
+            turn = "Black"
+        # The side that has just moved must not be left in check, otherwise its king could be taken.
+        probe = Board.__new__(Board)
+        probe.table = table
+        probe.calculate_bitboards()
+        if probe.is_attacked(probe.king_squares[opposite_color(turn)], turn):
+            raise ValueError("Invalid FEN, the side not to move is in check: " + fen)
+        self.table = table
+        self.turn = turn
+        # Castle rights are only kept when the king and the rook are still on their fields.
+        self.white_castle = ("Q" in fields[2] and table[4] == white_king and table[0] == white_rook,
+                             "K" in fields[2] and table[4] == white_king and table[7] == white_rook)
+        self.black_castle = ("q" in fields[2] and table[60] == black_king and table[56] == black_rook,
+                             "k" in fields[2] and table[60] == black_king and table[63] == black_rook)
+        self.en_passant = -1
+        if fields[3] != "-" and fields[3][0] in "abcdefgh":
+            # Only remember en passant when a pawn has just moved two fields over empty fields and it can actually
+            # be taken, the same as make_move does.
+            x = ord(fields[3][0]) - ord("a")
+            if self.turn == "White":
+                (y, passed, start) = (4, 5, 6)
+            else:
+                (y, passed, start) = (3, 2, 1)
+            if table[convert_point((x, y))] == get_piece("Pawn", opposite_color(self.turn)) and \
+                    table[convert_point((x, passed))] is None and table[convert_point((x, start))] is None:
+                for dx in (-1, 1):
+                    if 0 <= x + dx < 8 and table[convert_point((x + dx, y))] == get_piece("Pawn", self.turn):
+                        self.en_passant = x
+        self.moves = []
+        for i in range(64):
+            self.moves.append([])
+        # Hash of the position self.moves belongs to, and its check_info once calculated.
+        self.moves_hash = None
+        self.info = None
+        self.win = None
+        self.calculate_bitboards()
+        self.calculate_hash()
 
-        def check_direction(pieces, direction, slide):
-            current = add_vectors(point, direction)
-            while check_bounds(current):
-                field = self.table[convert_point(current)]
-                if field is not None:
-                    return field.piece_type in pieces and field.color != self.turn
-                if not slide:
-                    break
-                current = add_vectors(current, direction)
-            return False
+    def fen(self):
+        """
+        Describe the position in FEN. Move counters are not kept by the board and are written as 0 1.
+        :return: FEN string.
+        """
+        letters = {}
+        for letter, piece in fen_pieces.items():
+            letters[piece] = letter
+        rows = []
+        for y in range(7, -1, -1):
+            row = ""
+            empty = 0
+            for x in range(8):
+                field = self.table[convert_point((x, y))]
+                if field is None:
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                row += letters[field]
+            if empty:
+                row += str(empty)
+            rows.append(row)
+        castle = ""
+        for right, letter in zip((self.white_castle[1], self.white_castle[0], self.black_castle[1],
+                                  self.black_castle[0]), "KQkq"):
+            if right:
+                castle += letter
+        if self.en_passant == -1:
+            en_passant = "-"
+        elif self.turn == "White":
+            en_passant = "abcdefgh"[self.en_passant] + "6"
+        else:
+            en_passant = "abcdefgh"[self.en_passant] + "3"
+        return " ".join(["/".join(rows), self.turn[0].lower(), castle or "-", en_passant, "0", "1"])
 
-        def check_directions(pieces, directions, slide):
-            for direction in directions:
-                if check_direction(pieces, direction, slide):
-                    return True
-            return False
+    def to_bytes(self):
+        """
+        Pack the position into 34 bytes: 4 bits for every field (0 for empty, otherwise piece index + 1), a byte
+        with the turn and castle rights and a byte with the en passant column + 1.
+        :return: Bytes to be passed to Board.from_bytes.
+        """
+        codes = [field_codes[field] for field in self.table]
+        flags = self.white_castle[0] << 1 | self.white_castle[1] << 2 | self.black_castle[0] << 3 | \
+            self.black_castle[1] << 4
+        if self.turn == "Black":
+            flags |= 1
+        return bytes([codes[i] | codes[i + 1] << 4 for i in range(0, 64, 2)] + [flags, self.en_passant + 1])
 
-        if self.turn == "White":
-            pawn_directions = [(-1, 1), (1, 1)]
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Create a board from the result of to_bytes.
+        :param data: 34 bytes.
+        :return: New board.
+        """
+        if len(data) != 34 or data[32] > 31 or data[33] > 8:
+            raise ValueError("Invalid board bytes")
+        board = cls.__new__(cls)
+        # Bitboards and hash are built while unpacking, it is faster than calculating them from the table.
+        table = [None] * 64
+        bitboards = [0] * 12
+        hash = 0
+        index = 0
+        for byte in data[:32]:
+            for code in byte_codes[byte]:
+                if code:
+                    if code > 12:
+                        raise ValueError("Invalid board bytes")
+                    table[index] = code_pieces[code]
+                    bitboards[code - 1] |= 1 << index
+                    hash ^= zobrist_pieces[code - 1][index]
+                index += 1
+        kings = bitboards[5], bitboards[11]
+        if not kings[0] or not kings[1] or kings[0] & kings[0] - 1 or kings[1] & kings[1] - 1:
+            raise ValueError("Invalid board bytes, every side needs one king")
+        board.table = table
+        if data[32] & 1:
+            board.turn = "Black"
+            hash ^= zobrist_black_turn
+        else:
+            board.turn = "White"
+        board.white_castle = (bool(data[32] & 2), bool(data[32] & 4))
+        board.black_castle = (bool(data[32] & 8), bool(data[32] & 16))
+        board.en_passant = data[33] - 1
+        board.hash = hash ^ zobrist_castle[(board.white_castle, board.black_castle)] ^ \
+            zobrist_en_passant[board.en_passant]
+        board.bitboards = bitboards
+        board.occupied = {"White": bitboards[0] | bitboards[1] | bitboards[2] | bitboards[3] | bitboards[4] |
+                                   bitboards[5],
+                          "Black": bitboards[6] | bitboards[7] | bitboards[8] | bitboards[9] | bitboards[10] |
+                                   bitboards[11]}
+        board.king_squares = {"White": bitboards[5].bit_length() - 1, "Black": bitboards[11].bit_length() - 1}
+        board.moves = [[]] * 64
+        board.moves_hash = None
+        board.info = None
+        board.win = None
+        return board
+
+    def copy(self):
+        """
+        Create an independent board with the same position. Pieces and the generated moves are shared, they are
+        never changed in place, only the few lists and dictionaries that moves change are copied.
+        :return: New board.
+        """
+        board = self.__class__.__new__(self.__class__)
+        board.table = self.table[:]
+        board.turn = self.turn
+        board.white_castle = self.white_castle
+        board.black_castle = self.black_castle
+        board.en_passant = self.en_passant
+        board.moves = self.moves
+        board.moves_hash = self.moves_hash
+        board.info = self.info
+        board.win = self.win
+        board.bitboards = self.bitboards[:]
+        board.occupied = self.occupied.copy()
+        board.king_squares = self.king_squares.copy()
+        board.hash = self.hash
+        return board
+
+    def calculate_hash(self):
+        """
+        Calculate the Zobrist hash of the position from scratch. Afterwards make_move keeps it up to date.
+        """
+        self.hash = zobrist_castle[(self.white_castle, self.black_castle)] ^ zobrist_en_passant[self.en_passant]
+        if self.turn == "Black":
+            self.hash ^= zobrist_black_turn
+        for index, field in enumerate(self.table):
+            if field is not None:
+                self.hash ^= zobrist_pieces[field.index][index]
+
+    def calculate_bitboards(self):
+        """
+        Recalculate bitboards of every piece, occupancy masks of both colors and king fields from the table.
+        """
+        self.bitboards = [0] * 12
+        self.occupied = {"White": 0, "Black": 0}
+        self.king_squares = {"White": -1, "Black": -1}
+        for index, field in enumerate(self.table):
+            if field is not None:
+                self.bitboards[field.index] |= 1 << index
+                self.occupied[field.color] |= 1 << index
+                if field.piece_type == "King":
+                    self.king_squares[field.color] = index
+
+    def is_attacked(self, index, color, occupied=None):
+        """
+        Check if the field is attacked by pieces of given color.
+        :param index: Index of the field in the table.
+        :param color: Color of the attacking pieces. Example: White
+        :param occupied: Bitboard of occupied fields blocking sliding pieces. Defaults to the current position.
+        :return: True if the field is attacked. False otherwise.
+        """
+        bitboards = self.bitboards
+        if color == "White":
+            offset = 0
         else:
-            pawn_directions = [(-1, -1), (1, -1)]
+            offset = 6
+        if pawn_attacks[opposite_color(color)][index] & bitboards[offset] or \
+                knight_attacks[index] & bitboards[offset + 1] or \
+                king_attacks[index] & bitboards[offset + 5]:
+            return True
+        if occupied is None:
+            occupied = self.occupied["White"] | self.occupied["Black"]
+        queens = bitboards[offset + 4]
+        rooks = rook_lines[index] & (bitboards[offset + 3] | queens)
+        if rooks and ray_attacks(index, rook_directions, occupied) & rooks:
+            return True
+        bishops = bishop_lines[index] & (bitboards[offset + 2] | queens)
+        return bool(bishops and ray_attacks(index, bishop_directions, occupied) & bishops)
+
+    def attackers(self, index, occupied=None):
+        """
+        Find the pieces of both colors attacking the field.
+        :param index: Index of the field in the table.
+        :param occupied: Bitboard of occupied fields blocking sliding pieces. Defaults to the current position.
+        Pieces outside of it are still returned, remove them with & occupied when they are taken off.
+        :return: Bitboard of the attacking pieces.
+        """
+        bitboards = self.bitboards
+        if occupied is None:
+            occupied = self.occupied["White"] | self.occupied["Black"]
+        rooks = bitboards[3] | bitboards[4] | bitboards[9] | bitboards[10]
+        bishops = bitboards[2] | bitboards[4] | bitboards[8] | bitboards[10]
+        attackers = pawn_attacks["Black"][index] & bitboards[0] | pawn_attacks["White"][index] & bitboards[6] | \
+            knight_attacks[index] & (bitboards[1] | bitboards[7]) | king_attacks[index] & (bitboards[5] | bitboards[11])
+        if rook_lines[index] & rooks:
+            attackers |= ray_attacks(index, rook_directions, occupied) & rooks
+        if bishop_lines[index] & bishops:
+            attackers |= ray_attacks(index, bishop_directions, occupied) & bishops
+        return attackers
 
-        return check_directions({"Rook", "Queen"}, rook_directions, True) or \
-               check_directions({"Bishop", "Queen"}, bishop_directions, True) or \
-               check_directions({"Knight"}, knight_directions, False) or \
-               check_directions({"King"}, king_directions, False) or \
-               check_directions({"Pawn"}, pawn_directions, False)
+    def see(self, move):
+        """
+        Static exchange evaluation: what the move wins if both sides keep capturing on its target field with their
+        least valuable piece, and each may stop when going on would lose. Pieces behind sliding pieces join in as
+        the pieces in front of them are taken off. No moves are made. Pins and promotions of later captures are not
+        looked at.
+        :param move: Move as used by make_move, or its 16 bit code.
+        :return: Material won by the player whose turn it is, in centipawns. 0 for quiet moves that can not be
+        taken, negative when the moved piece is lost.
+        """
+        if isinstance(move, int):
+            move = decode_move(move)
+        index = convert_point(move[0])
+        target = convert_point(move[1])
+        field = self.table[index]
+        captured = self.table[target]
+        if captured is not None and captured.color == field.color:
+            return 0
+        bitboards = self.bitboards
+        occupied = (self.occupied["White"] | self.occupied["Black"]) ^ (1 << index)
+        gains = [0]
+        if captured is not None:
+            gains[0] = exchange_values[captured.index % 6]
+        elif field.piece_type == "Pawn" and index % 8 != target % 8:
+            gains[0] = exchange_values[0]
+            occupied ^= 1 << (index // 8 * 8 + target % 8)
+        value = exchange_values[field.index % 6]
+        if len(move) == 3:
+            value = exchange_values[get_piece(move[2], field.color).index % 6]
+            gains[0] += value - exchange_values[0]
+        rooks = bitboards[3] | bitboards[4] | bitboards[9] | bitboards[10]
+        bishops = bitboards[2] | bitboards[4] | bitboards[8] | bitboards[10]
+        attackers = self.attackers(target, occupied) & occupied
+        color = opposite_color(field.color)
+        while True:
+            if color == "White":
+                offset = 0
+            else:
+                offset = 6
+            own = attackers & self.occupied[color]
+            if not own:
+                break
+            for piece in range(6):
+                pieces = own & bitboards[offset + piece]
+                if pieces:
+                    break
+            if piece == 5 and attackers & self.occupied[opposite_color(color)]:
+                # The king can not take a defended piece.
+                break
+            gains.append(value - gains[-1])
+            value = exchange_values[piece]
+            occupied ^= pieces & -pieces
+            if piece in (0, 2, 4):
+                attackers |= ray_attacks(target, bishop_directions, occupied) & bishops
+            if piece in (3, 4):
+                attackers |= ray_attacks(target, rook_directions, occupied) & rooks
+            attackers &= occupied
+            color = opposite_color(color)
+        # Going back from the last capture, each side takes the better of capturing or stopping.
+        for depth in range(len(gains) - 1, 0, -1):
+            gains[depth - 1] = -max(-gains[depth - 1], gains[depth])
+        return gains[0]
+
+    def is_checked(self, point):
+        """
+        Check if given point is checked by the opposite color.
+        :param point: Point to check.
+        :return: True if the point is checked. False otherwise.
+        """
+        return self.is_attacked(convert_point(point), opposite_color(self.turn))
 
     @property
     def king_checked(self):
@@ -209,55 +777,91 @@ class Board:
         Check if the king is checked on the board.
         :return: True if king is checked.
         """
-        return self.is_checked(convert_index(self.table.index(get_piece("King", self.turn))))
+        return self.is_attacked(self.king_squares[self.turn], opposite_color(self.turn))
+
+    def put_piece(self, index, piece):
+        """
+        Put the piece on an empty field, keeping the bitboards up to date.
+        :param index: Index of the field in the table.
+        :param piece: Piece to put.
+        """
+        self.table[index] = piece
+        self.bitboards[piece.index] |= 1 << index
+        self.occupied[piece.color] |= 1 << index
+        self.hash ^= zobrist_pieces[piece.index][index]
+
+    def remove_piece(self, index):
+        """
+        Remove the piece from an occupied field, keeping the bitboards up to date.
+        :param index: Index of the field in the table.
+        :return: Removed piece.
+        """
+        piece = self.table[index]
+        self.table[index] = None
+        self.bitboards[piece.index] ^= 1 << index
+        self.occupied[piece.color] ^= 1 << index
+        self.hash ^= zobrist_pieces[piece.index][index]
+        return piece
 
     def make_move(self, prev, nxt, promotion="Queen"):
         """
         Make one move on given board. It also changes the players turn.
         :param promotion: To which piece the pawn should promote.
-        :return: Nothing?
+        :return: Undo record that can be passed to unmake_move.
         """
         prev_x, prev_y = prev
         next_x, next_y = nxt
-        new_table = list(self.table)
 
-        def check_en_passant(new_table, x):
+        def check_en_passant(x):
             return 0 <= x < 8 and \
-                   new_table[convert_point((x, next_y))] == get_piece("Pawn", opposite_color(self.turn))
+                   self.table[convert_point((x, next_y))] == get_piece("Pawn", opposite_color(self.turn))
 
         previous = (prev_x, prev_y)
         next = (next_x, next_y)
-        field_first = self.table[convert_point(previous)]
-        field_second = self.table[convert_point(next)]
+        previous_index = convert_point(previous)
+        next_index = convert_point(next)
+        field_first = self.table[previous_index]
+        field_second = self.table[next_index]
+        undo = (previous_index, next_index, field_first, field_second,
+                self.white_castle, self.black_castle, self.en_passant, self.hash)
+        self.hash ^= zobrist_castle[(self.white_castle, self.black_castle)] ^ \
+                     zobrist_en_passant[self.en_passant] ^ zobrist_black_turn
+        self.en_passant = -1
         if field_second is None or field_second.color != self.turn:
-            new_table[convert_point(previous)] = None
-            if field_first.piece_type == "Pawn":  
+            self.remove_piece(previous_index)
+            if field_second is not None:
+                self.remove_piece(next_index)
+            if field_first.piece_type == "Pawn":
                 if next_y == 7 or next_y == 0:
-                    new_table[convert_point(next)] = get_piece(promotion, self.turn)
+                    self.put_piece(next_index, get_piece(promotion, self.turn))
                 else:
-                    new_table[convert_point(next)] = field_first
+                    self.put_piece(next_index, field_first)
+                if prev_x != next_x and field_second is None:
+                    # En passant, the captured pawn stands next to the starting field.
+                    self.remove_piece(convert_point((next_x, prev_y)))
                 if abs(prev_y - next_y) == 2:
-                    if check_en_passant(new_table, prev_x - 1) or check_en_passant(new_table, prev_x + 1):
+                    if check_en_passant(prev_x - 1) or check_en_passant(prev_x + 1):
                         self.en_passant = prev_x
-                    else:
-                        self.en_passant = -1
             else:
-                new_table[convert_point(next)] = field_first
+                self.put_piece(next_index, field_first)
+                if field_first.piece_type == "King":
+                    self.king_squares[self.turn] = next_index
         else:
             if self.turn == "White":
                 row = 0
             else:
                 row = 7
-            new_table[convert_point(previous)] = None
-            new_table[convert_point(next)] = None
+            self.remove_piece(previous_index)
+            self.remove_piece(next_index)
             if prev_x == 0 or next_x == 0:
-                new_table[convert_point((2, row))] = get_piece("King", self.turn)
-                new_table[convert_point((3, row))] = get_piece("Rook", self.turn)
+                self.put_piece(convert_point((2, row)), get_piece("King", self.turn))
+                self.put_piece(convert_point((3, row)), get_piece("Rook", self.turn))
+                self.king_squares[self.turn] = convert_point((2, row))
             else:
-                new_table[convert_point((6, row))] = get_piece("King", self.turn)
-                new_table[convert_point((5, row))] = get_piece("Rook", self.turn)
+                self.put_piece(convert_point((6, row)), get_piece("King", self.turn))
+                self.put_piece(convert_point((5, row)), get_piece("Rook", self.turn))
+                self.king_squares[self.turn] = convert_point((6, row))
         self.turn = opposite_color(self.turn)
-        self.table = new_table
         self.white_castle = (self.white_castle[0] and
                              previous != (4, 0) and
                              next != (4, 0) and
@@ -268,16 +872,70 @@ class Board:
                              next != (4, 0) and
                              previous != (7, 0) and
                              next != (7, 0))
-        self.black_castle = (self.white_castle[0] and
+        self.black_castle = (self.black_castle[0] and
                              previous != (4, 7) and
                              next != (4, 7) and
                              previous != (0, 7) and
                              next != (0, 7),
-                             self.white_castle[1] and
+                             self.black_castle[1] and
                              previous != (4, 7) and
                              next != (4, 7) and
                              previous != (7, 7) and
                              next != (7, 7))
+        self.hash ^= zobrist_castle[(self.white_castle, self.black_castle)] ^ zobrist_en_passant[self.en_passant]
+        return undo
+
+    def make_encoded_move(self, code):
+        """
+        Make a move given in the 16 bit encoding.
+        :param code: Encoded move.
+        :return: Undo record that can be passed to unmake_move.
+        """
+        flags = code >> 12
+        if flags & promotion_flag:
+            return self.make_move(index_points[code & 63], index_points[code >> 6 & 63], promotion_pieces[flags & 3])
+        return self.make_move(index_points[code & 63], index_points[code >> 6 & 63])
+
+    def move_code(self, move):
+        """
+        Encode a move of this position with the same flags generate_moves gives it.
+        :param move: Move as used by make_move.
+        :return: Encoded move.
+        """
+        (previous, next) = move[:2]
+        field = self.table[convert_point(previous)]
+        target = self.table[convert_point(next)]
+        if field.piece_type == "King" and target is not None and target.color == field.color:
+            return encode_move(move, castle_flag)
+        if field.piece_type == "Pawn" and target is None and previous[0] != next[0]:
+            return encode_move(move, en_passant_flag)
+        return encode_move(move)
+
+    def unmake_move(self, undo):
+        """
+        Take back a move made with make_move. Moves have to be taken back in reverse order.
+        :param undo: Undo record returned by make_move.
+        """
+        previous, next, moving, captured, self.white_castle, self.black_castle, self.en_passant, old_hash = undo
+        self.turn = opposite_color(self.turn)
+        if captured is not None and captured.color == moving.color:
+            row = previous // 8 * 8
+            if previous % 8 == 0 or next % 8 == 0:
+                self.remove_piece(row + 2)
+                self.remove_piece(row + 3)
+            else:
+                self.remove_piece(row + 6)
+                self.remove_piece(row + 5)
+        else:
+            self.remove_piece(next)
+            if moving.piece_type == "Pawn" and captured is None and previous % 8 != next % 8:
+                self.put_piece(previous // 8 * 8 + next % 8, get_piece("Pawn", opposite_color(moving.color)))
+        self.put_piece(previous, moving)
+        if moving.piece_type == "King":
+            self.king_squares[moving.color] = previous
+        if captured is not None:
+            self.put_piece(next, captured)
+        self.hash = old_hash
 
     @property
     def can_castle(self):
@@ -306,128 +964,339 @@ class Board:
                not self.is_checked((5, row)) and \
                not self.is_checked((6, row))
 
+    def move_targets(self, index):
+        """
+        Fields the piece standing on the field can move to, not counting castles and not caring about checks.
+        :param index: Index of the field with a piece of the player whose turn it is.
+        :return: Bitboard of target fields.
+        """
+        field = self.table[index]
+        own = self.occupied[self.turn]
+        empty = ~(own | self.occupied[opposite_color(self.turn)])
+        if field.piece_type == "Pawn":
+            if self.turn == "White":
+                forward = (0, 1)
+                double_rank = rank_masks[2]
+                en_passant_row = 5
+            else:
+                forward = (0, -1)
+                double_rank = rank_masks[5]
+                en_passant_row = 2
+            targets = shift(1 << index, forward) & empty
+            targets |= shift(targets & double_rank, forward) & empty
+            captures = pawn_attacks[self.turn][index]
+            targets |= captures & ~own & ~empty
+            if self.en_passant != -1:
+                targets |= captures & empty & (1 << convert_point((self.en_passant, en_passant_row)))
+            return targets
+        if field.slide:
+            targets = ray_attacks(index, field.directions, ~empty)
+        elif field.piece_type == "Knight":
+            targets = knight_attacks[index]
+        else:
+            targets = king_attacks[index]
+        return targets & ~own
+
+    def target_moves(self, point, targets):
+        """
+        Make list of moves from the point to every target field. Pawns reaching the last row get one move for every
+        promotion.
+        :param point: Starting point of the moves.
+        :param targets: Bitboard of target fields.
+        :return: List of moves.
+        """
+        moves = []
+        promotions = self.table[convert_point(point)].piece_type == "Pawn"
+        for target in iterate_bits(targets):
+            next = convert_index(target)
+            if promotions and (next[1] == 0 or next[1] == 7):
+                moves += [(point, next, officer) for officer in ["Bishop", "Knight", "Rook", "Queen"]]
+            else:
+                moves.append((point, next))
+        return moves
+
+    def castle_moves(self):
+        """
+        Castle moves the player whose turn it is can make. A castle moves the king onto its own rook.
+        :return: List of moves.
+        """
+        if self.turn == "White":
+            row = 0
+        else:
+            row = 7
+        moves = []
+        (queen_side, king_side) = self.can_castle
+        if king_side:
+            moves += [((4, row), (7, row))]
+        if queen_side:
+            moves += [((4, row), (0, row))]
+        return moves
+
     def possible_moves(self, point):
         """
-        Generates all possible moves from given point. It should be calculated only
-        once and then stored as a field in board. One should use get_moves instead of
-        possible_moves.
+        Generates all possible moves from given point, without checking if they leave the king checked. Use
+        get_moves or legal_moves for legal moves.
         :return: List containing all possible moves from given point.
         """
-        x, y = point
+        index = convert_point(point)
+        field = self.table[index]
+        if field is None or field.color != self.turn:
+            return []
+        moves = self.target_moves(point, self.move_targets(index))
+        if field.piece_type == "King":
+            moves += self.castle_moves()
+        return moves
 
-        def check_direction(direction, slide):
-            moves = []
-            current_point = add_vectors(point, direction)
-            while check_bounds(current_point):
-                field = self.table[convert_point(current_point)]
-                if field is None:
-                    moves += [(point, current_point)]
-                elif field.color != self.turn:
-                    moves += [(point, current_point)]
-                    break
-                else:
-                    break
-                if not slide:
-                    break
-                current_point = add_vectors(current_point, direction)
-            return moves
+    def is_legal(self, move):
+        """
+        Check if the move returned by possible_moves does not leave the own king checked, by playing it.
+        :param move: Move to check.
+        :return: True if the move is legal.
+        """
+        undo = self.make_move(*move)
+        self.turn = opposite_color(self.turn)
+        legal = not self.king_checked
+        self.turn = opposite_color(self.turn)
+        self.unmake_move(undo)
+        return legal
 
-        def check_directions(directions, slide):
-            moves = []
+    def check_info(self):
+        """
+        Find the checks and pins restricting the player whose turn it is. Calculated once per position and passed
+        to legal_moves_from.
+        :return: Tuple (checkers, check_mask, pins). checkers is bitboard of pieces checking the king, check_mask
+        bitboard of fields other pieces have to move to (capturing the checker or blocking the check) and pins
+        dictionary from index of pinned piece to bitboard of fields it can move to without leaving the pin line.
+        """
+        king = self.king_squares[self.turn]
+        own = self.occupied[self.turn]
+        occupied = own | self.occupied[opposite_color(self.turn)]
+        bitboards = self.bitboards
+        if self.turn == "White":
+            offset = 6
+        else:
+            offset = 0
+        queens = bitboards[offset + 4]
+        checkers = pawn_attacks[self.turn][king] & bitboards[offset] | knight_attacks[king] & bitboards[offset + 1]
+        check_mask = checkers
+        pins = {}
+        for directions, sliders in ((rook_directions, bitboards[offset + 3] | queens),
+                                    (bishop_directions, bitboards[offset + 2] | queens)):
             for direction in directions:
-                moves += check_direction(direction, slide)
-            return moves
+                table, positive = rays[direction]
+                ray = table[king]
+                if not ray & sliders:
+                    continue
+                blockers = ray & occupied
+                if positive:
+                    first = (blockers & -blockers).bit_length() - 1
+                else:
+                    first = blockers.bit_length() - 1
+                if sliders >> first & 1:
+                    checkers |= 1 << first
+                    check_mask |= ray ^ table[first]
+                elif own >> first & 1:
+                    blockers = table[first] & occupied
+                    if not blockers:
+                        continue
+                    if positive:
+                        second = (blockers & -blockers).bit_length() - 1
+                    else:
+                        second = blockers.bit_length() - 1
+                    if sliders >> second & 1:
+                        pins[first] = ray ^ table[second]
+        if not checkers:
+            check_mask = full_mask
+        return checkers, check_mask, pins
 
-        field = self.table[convert_point(point)]
-        officers = ["Bishop", "Knight", "Rook", "Queen"]
-        if field is None or field.color != self.turn:
-            return []
-        if field.piece_type == "Pawn":
-            # No capture moves.
-            moves = []
+    def legal_targets(self, index, info):
+        """
+        Fields the piece can legally move to, using checks and pins of the position instead of playing every move.
+        Castles are not included.
+        :param index: Index of the field with a piece of the player whose turn it is.
+        :param info: Result of check_info for the current position.
+        :return: Bitboard of target fields.
+        """
+        checkers, check_mask, pins = info
+        field = self.table[index]
+        targets = self.move_targets(index)
+        if field.piece_type == "King":
+            enemy = opposite_color(self.turn)
+            # The king must not hide from a sliding piece behind its own field.
+            occupied = (self.occupied["White"] | self.occupied["Black"]) ^ (1 << index)
+            for target in iterate_bits(targets):
+                if self.is_attacked(target, enemy, occupied):
+                    targets ^= 1 << target
+            return targets
+        if checkers & (checkers - 1):
+            # Double check, only the king can move.
+            return 0
+        if field.piece_type == "Pawn" and self.en_passant != -1:
             if self.turn == "White":
-                delta = (0, 1)
+                en_passant_row = 5
             else:
-                delta = (0, -1)
-            next = add_vectors(point, delta)
-            next_field = self.table[convert_point(next)]
-            if check_bounds(next) and next_field is None:
-                if next[1] == 0 or next[1] == 7:
-                    moves += map(lambda officer: (point, next, officer), officers)
-                else:
-                    moves += [(point, next)]
-            if (y == 1 and self.turn == "White") or (y == 6 and self.turn == "Black"):
-                temp_field = next_field
-                next = add_vectors(next, delta)
-                next_field = self.table[convert_point(next)]
-                if temp_field is None and next_field is None:
-                    moves += [(point, next)]
-
-            # Capture moves
-            def check_column(dx):
-                next = add_vectors(point, (dx, delta[1]))
-                next_field = self.table[convert_point(next)]
-                if check_bounds(next):
-                    if next_field is None:
-                        if self.en_passant == next[0] and \
-                                ((next[1] == 5 and self.turn == "White") or \
-                                         (next[1] == 2 and self.turn == "Black")):
-                            return [(point, next)]
-                    elif next_field.color != self.turn:
-                        if next[1] == 0 or next[1] == 7:
-                            return map(lambda officer: (point, next, officer), officers)
-                        else:
-                            return [(point, next)]
-                return []
-
-            moves += check_column(-1)
-            moves += check_column(1)
-            return moves
+                en_passant_row = 2
+            en_passant = targets & (1 << convert_point((self.en_passant, en_passant_row)))
+            if en_passant and not self.en_passant_legal(index, en_passant, checkers, check_mask):
+                targets ^= en_passant
         else:
-            moves = []
-            if self.turn == "White":
-                row = 0
-            else:
-                row = 7
-            if field.piece_type == "King" or field.piece_type == "Rook":
-                (queen_side, king_side) = self.can_castle
-                if king_side:
-                    moves += [((4, row), (7, row))]
-                if queen_side:
-                    moves += [((4, row), (0, row))]
-            return moves + check_directions(field.directions, field.slide)
+            en_passant = 0
+        targets &= check_mask | en_passant
+        if index in pins:
+            targets &= pins[index]
+        return targets
+
+    def legal_moves_from(self, point, info=None):
+        """
+        Generate legal moves from given point.
+        :param point: Point from which.
+        :param info: Result of check_info for the current position. Calculated when not given.
+        :return: List of legal moves from given point.
+        """
+        index = convert_point(point)
+        field = self.table[index]
+        if field is None or field.color != self.turn:
+            return []
+        if info is None:
+            info = self.check_info()
+        moves = self.target_moves(point, self.legal_targets(index, info))
+        if field.piece_type == "King" and not info[0]:
+            moves += self.castle_moves()
+        return moves
+
+    def en_passant_legal(self, index, target, checkers, check_mask):
+        """
+        Check if the en passant capture does not leave the king checked. Both pawns leave their row at once, which
+        can uncover a sliding piece the pins do not see.
+        :param index: Index of the capturing pawn.
+        :param target: Bitboard with the field the pawn moves to.
+        :return: True if the capture is legal.
+        """
+        if self.turn == "White":
+            captured = target >> 8
+            offset = 6
+        else:
+            captured = target << 8
+            offset = 0
+        if not (target & check_mask or captured & checkers):
+            return False
+        king = self.king_squares[self.turn]
+        bitboards = self.bitboards
+        queens = bitboards[offset + 4]
+        occupied = (self.occupied["White"] | self.occupied["Black"]) ^ (1 << index) ^ target ^ captured
+        return not (ray_attacks(king, rook_directions, occupied) & (bitboards[offset + 3] | queens) or
+                    ray_attacks(king, bishop_directions, occupied) & (bitboards[offset + 2] | queens))
+
+    def generate_moves(self, buffer):
+        """
+        Write all legal moves of the position into the buffer in the 16 bit encoding. Nothing else is allocated
+        per move, so the same buffer can be reused for every position.
+        :param buffer: Buffer created by move_buffer.
+        :return: Number of moves written to the beginning of the buffer.
+        """
+        info = self.check_info()
+        if self.turn == "White":
+            row = 0
+            last_row = rank_masks[7]
+            en_passant = convert_point((self.en_passant, 5))
+        else:
+            row = 7
+            last_row = rank_masks[0]
+            en_passant = convert_point((self.en_passant, 2))
+        count = 0
+        for index in iterate_bits(self.occupied[self.turn]):
+            targets = self.legal_targets(index, info)
+            if self.table[index].piece_type == "Pawn":
+                for target in iterate_bits(targets & last_row):
+                    for piece in range(4):
+                        buffer[count] = index | target << 6 | (promotion_flag | piece) << 12
+                        count += 1
+                targets &= ~last_row
+                if self.en_passant != -1 and targets >> en_passant & 1:
+                    buffer[count] = index | en_passant << 6 | en_passant_flag << 12
+                    count += 1
+                    targets ^= 1 << en_passant
+            for target in iterate_bits(targets):
+                buffer[count] = index | target << 6
+                count += 1
+        if not info[0]:
+            (queen_side, king_side) = self.can_castle
+            if king_side:
+                buffer[count] = row * 8 + 4 | (row * 8 + 7) << 6 | castle_flag << 12
+                count += 1
+            if queen_side:
+                buffer[count] = row * 8 + 4 | (row * 8) << 6 | castle_flag << 12
+                count += 1
+        return count
+
+    def legal_moves(self):
+        """
+        Generate all legal moves in the position without touching the stored moves.
+        :return: List of all legal moves.
+        """
+        info = self.check_info()
+        moves = []
+        for i in iterate_bits(self.occupied[self.turn]):
+            moves += self.legal_moves_from(convert_index(i), info)
+        return moves
 
     def recalculate_moves(self):
         """
-        Recalculate all possible moves that can be done from each field.
+        Prepare the moves of the current position and decide if the game is won. The moves of a field are only
+        generated when get_moves asks for them. Positions seen before are taken from move_cache, with the moves
+        found so far. The stored lists are shared with the cache and must not be modified.
         """
+        self.current_moves()
+        if self.has_any_legal_move():
+            self.win = None
+        else:
+            self.win = opposite_color(self.turn)
 
-        def check_move(move):
-            promotion = "Queen"
-            if len(move) == 2:
-                (previous, next) = move
-            else:
-                (previous, next, promotion) = move
-            new = copy.copy(self)
-            new.table = copy.copy(self.table)
-            new.turn = copy.copy(self.turn)
-            new.white_castle = copy.copy(self.white_castle)
-            new.black_castle = copy.copy(self.black_castle)
-            new.en_passant = copy.copy(self.en_passant)
-            new.make_move(previous, next, promotion)
-            new.turn = opposite_color(new.turn)
-            return not new.king_checked
-
-        self.win = opposite_color(self.turn)
-        for i in range(64):
-            self.moves[i] = list(filter(check_move, self.possible_moves(convert_index(i))) )
-            if self.moves[i]:
-                self.win = None
+    def current_moves(self):
+        """
+        Moves of every field of the current position. They are kept until the position changes.
+        :return: List with the list of moves for every field, or None for fields not generated yet.
+        """
+        if self.moves_hash != self.hash:
+            moves = None
+            if move_cache is not None:
+                moves = move_cache.get(self.hash)
+            if moves is None:
+                moves = [None] * 64
+                if move_cache is not None:
+                    move_cache.put(self.hash, moves)
+            self.moves = moves
+            self.moves_hash = self.hash
+            self.info = None
+        return self.moves
 
     def get_moves(self, point):
         """
-        Get possible moves from given point. This uses previously cached informations.
+        Get possible moves from given point. They are generated on the first call for the position and then reused.
         :param point: Point from which
         :return: All possible moves that can be done from given point.
         """
-        return self.moves[convert_point(point)]
+        index = convert_point(point)
+        moves = self.current_moves()
+        if moves[index] is None:
+            if self.info is None:
+                self.info = self.check_info()
+            moves[index] = self.legal_moves_from(point, self.info)
+        return moves[index]
+
+    def has_any_legal_move(self):
+        """
+        Check if the player whose turn it is can move, stopping at the first piece that can. Castles are not looked
+        at, a king that can castle can also step aside.
+        :return: True if there is a legal move.
+        """
+        moves = self.current_moves()
+        for field_moves in moves:
+            if field_moves:
+                return True
+        if self.info is None:
+            self.info = self.check_info()
+        for index in iterate_bits(self.occupied[self.turn]):
+            if moves[index] is None and self.legal_targets(index, self.info):
+                return True
+        return False
@@ -1,21 +1,51 @@
 __author__ = 'Maksymilian Mika'
 
+import os
+import sys
 import Chess
+import Engine
+import Worker
 import pygame
 
+# Event posted when the background worker has a result ready.
+worker_event = pygame.event.custom_type()
+# Images already loaded from the res directory, by file name.
+sprites = {}
+# The res directory next to src, so images are found from any working directory.
+res_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "res")
+
+
+def load_sprite(name):
+    """
+    Load image from the res directory. Every image is read from the disk only once.
+    :param name: File name without extension. Example: white_pawn
+    :return: Surface, converted to the pixel format of the screen when there is one.
+    """
+    if name not in sprites:
+        image = pygame.image.load(os.path.join(res_directory, name + ".png"))
+        if pygame.display.get_surface() is not None:
+            image = image.convert_alpha()
+        sprites[name] = image
+    return sprites[name]
+
 
 class BoardDisplay:
-    def __init__(self):
+    def __init__(self, computer=None, limits=None, book=None):
         """
-        Initialize images and create beginning board. Also recalculate the moves that
+        Initialize images and create beginning board. Also start calculating the moves that
         can be done on the board.
+        :param computer: Color played by the computer. Example: Black. None for two human players.
+        :param limits: Limits of the computer's search.
+        :param book: Opening book the computer plays from, Book.Book.
         """
         self.field_width = 60
         self.field_height = 60
         self.width = self.field_width * 8
         self.height = self.field_height * 8
         self.board = Chess.Board()
-        self.board.recalculate_moves()
+        # Moves and computer replies are calculated by the worker, nothing can be dragged until they come back.
+        self.worker = Worker.Worker(self.wake, book)
+        self.waiting = False
 
         # Change to prettier fields
         self.white_field = pygame.Surface((self.field_width, self.field_height))
@@ -29,58 +59,122 @@ class BoardDisplay:
         self.move_field.fill((139, 0, 0))
         self.move_field.set_alpha(115)
 
+        # The fields never change, so they are drawn once and later copied.
+        self.background = pygame.Surface((self.width, self.height))
+        for i in range(64):
+            (x, y) = Chess.convert_index(i)
+            if (x + y) % 2 == 0:
+                self.background.blit(self.white_field, (x * self.field_width, y * self.field_height))
+            else:
+                self.background.blit(self.black_field, (x * self.field_width, y * self.field_height))
+
+        # Parts of the screen that have to be drawn again, everything at the beginning.
+        self.dirty = []
+        self.invalidate()
+
         self.pieces = []
-        index = 0
-        for field in self.board.table:
-            if field is not None:
-                self.pieces.append(Piece(field, Chess.convert_index(index)))
-            index += 1
+        self.shown = [None] * 64
+        self.update_pieces()
 
         self.dragged_piece = None
+        self.drag_rect = None
         self.possible_moves = []
 
         self.opaque = 0
+        self.overlay = pygame.Surface((self.width, self.height))
 
-        self.white_wins = pygame.image.load("res/white_wins.png")
-        self.black_wins = pygame.image.load("res/black_wins.png")
+        self.white_wins = load_sprite("white_wins")
+        self.black_wins = load_sprite("black_wins")
+
+        self.computer = computer
+        self.limits = limits
+        if self.limits is None:
+            self.limits = Engine.Limits(time=2.0)
+        self.calculate()
 
     def display(self, screen):
         """
-        Display current status of the board.
+        Draw the parts of the board that changed since the last call.
         :param screen: Screen on which the board is to be displayed.
+        :return: List of rectangles that were drawn, to be passed to pygame.display.update.
         """
-        for i in range(64):
-            (x, y) = Chess.convert_index(i)
-            if (x + y) % 2 == 0:
-                screen.blit(self.white_field, (x * self.field_width, y * self.field_height))
-            else:
-                screen.blit(self.black_field, (x * self.field_width, y * self.field_height))
-        for move in self.possible_moves:
-            if len(move) == 2:
-                (previous, next) = move
-                screen.blit(self.move_field, (previous[0] * self.field_width, previous[1] * self.field_height))
-                screen.blit(self.move_field, (next[0] * self.field_width, next[1] * self.field_height))
-            else:
-                (previous, next, promotion) = move
-                screen.blit(self.move_field, (previous[0] * self.field_width, previous[1] * self.field_height))
-                screen.blit(self.move_field, (next[0] * self.field_width, next[1] * self.field_height))
-        for piece in self.pieces:
-            piece.display(screen)
-        if self.board.win is not None:
+        rect = None
+        if self.dragged_piece is not None:
+            rect = self.dragged_piece.rect()
+        if rect != self.drag_rect:
+            if self.drag_rect is not None:
+                self.invalidate(self.drag_rect)
+            if rect is not None:
+                self.invalidate(rect)
+            self.drag_rect = rect
+        if self.board.win is not None and self.opaque < 225:
+            if self.opaque == 0:
+                if self.board.win == "White":
+                    self.overlay.fill((255, 255, 255))
+                else:
+                    self.overlay.fill((0, 0, 0))
             self.opaque += 3
             if self.opaque > 225:
                 self.opaque = 225
-            surface = pygame.Surface((self.width, self.height))
-            if self.board.win == "White":
-                surface.fill((255, 255, 255))
-            else:
-                surface.fill((0, 0, 0))
-            surface.set_alpha(self.opaque)
-            screen.blit(surface, (0, 0))
-            if self.board.win == "White":
-                screen.blit(self.white_wins, (0, 0))
-            else:
-                screen.blit(self.black_wins, (0, 0))
+            self.overlay.set_alpha(self.opaque)
+            self.invalidate()
+
+        dirty = self.dirty
+        self.dirty = []
+        for area in dirty:
+            screen.set_clip(area)
+            screen.blit(self.background, area, area)
+            for move in self.possible_moves:
+                for point in move[:2]:
+                    if self.field_rect(point).colliderect(area):
+                        screen.blit(self.move_field, (point[0] * self.field_width, point[1] * self.field_height))
+            for piece in self.pieces:
+                if piece.rect().colliderect(area):
+                    piece.display(screen)
+            if self.board.win is not None:
+                screen.blit(self.overlay, (0, 0))
+                if self.board.win == "White":
+                    screen.blit(self.white_wins, (0, 0))
+                else:
+                    screen.blit(self.black_wins, (0, 0))
+        screen.set_clip(None)
+        return dirty
+
+    def invalidate(self, rect=None):
+        """
+        Mark part of the screen to be drawn again by the next display.
+        :param rect: Rectangle to draw again, the whole board when not given.
+        """
+        if rect is None:
+            self.dirty = [pygame.Rect(0, 0, self.width, self.height)]
+        elif not self.dirty or not self.dirty[0].contains(rect):
+            self.dirty.append(pygame.Rect(rect))
+
+    def field_rect(self, point):
+        """
+        Rectangle of the screen covered by the field.
+        :param point: Point of the field. Example: (4, 1)
+        :return: pygame.Rect of the field.
+        """
+        return pygame.Rect(point[0] * self.field_width, point[1] * self.field_height, self.field_width,
+                           self.field_height)
+
+    def show_moves(self, moves):
+        """
+        Change the highlighted moves.
+        :param moves: List of moves to highlight.
+        """
+        for move in self.possible_moves + moves:
+            for point in move[:2]:
+                self.invalidate(self.field_rect(point))
+        self.possible_moves = moves
+
+    def animating(self):
+        """
+        Tell if the board still changes without any event, so the main loop must not wait for events.
+        :return: True if something is left to draw or the winner is being faded in.
+        """
+        return bool(self.dirty) or self.board.win is not None and self.opaque < 225
 
     def find_field(self, pos):
         """
@@ -98,17 +192,18 @@ class BoardDisplay:
         This means that someone is dragging the thing that is on (x,y).
         """
         x,y = p
-        if self.board.win is not None:
+        if self.board.win is not None or self.waiting:
             return
         x //= self.field_width
         y //= self.field_height
-        self.possible_moves = self.board.get_moves((x, y))
+        self.show_moves(self.board.get_moves((x, y)))
         if not self.possible_moves:
             return
         field = self.find_field((x, y))
         if field is not None:
             field.dragged = True
             self.dragged_piece = field
+            self.invalidate(self.field_rect((x, y)))
 
     def dropped(self, p):
         """
@@ -122,67 +217,116 @@ class BoardDisplay:
         if self.dragged_piece is not None and ((self.dragged_piece.position, (x, y)) in self.possible_moves \
                                                        or (
                     self.dragged_piece.position, (x, y), "Queen") in self.possible_moves):
-            self.board.make_move(self.dragged_piece.position, (x, y))
-            print(str(self.dragged_piece.position) + " " + str((x, y)))
-            print(self.board)
-            self.pieces = []
-            index = 0
-            for field in self.board.table:
-                if field is not None:
-                    self.pieces.append(Piece(field, Chess.convert_index(index)))
-                index += 1
-            self.board.recalculate_moves()
             self.dragged_piece.dragged = False
+            self.play((self.dragged_piece.position, (x, y)))
             self.dragged_piece = None
-            self.possible_moves = []
+            self.show_moves([])
         elif self.dragged_piece is not None:
             self.dragged_piece.dragged = False
+            self.invalidate(self.field_rect(self.dragged_piece.position))
             self.dragged_piece = None
 
+    def play(self, move):
+        """
+        Make the move on the board and show the new position.
+        :param move: Move as used by Chess.Board.make_move.
+        """
+        self.board.make_move(*move)
+        print(str(move[0]) + " " + str(move[1]))
+        print(self.board)
+        self.update_pieces()
+        self.calculate()
+
+    def update_pieces(self):
+        """
+        Bring the displayed pieces in line with the board. Only fields that changed since the last update get new
+        pieces, everything else is left as it is.
+        """
+        for index in range(64):
+            field = self.board.table[index]
+            if field is self.shown[index]:
+                continue
+            point = Chess.convert_index(index)
+            old = self.find_field(point)
+            if old is not None:
+                self.pieces.remove(old)
+            if field is not None:
+                self.pieces.append(Piece(field, point))
+            self.shown[index] = field
+            self.invalidate(self.field_rect(point))
+
+    def calculate(self):
+        """
+        Start calculating the moves of the current position. Jobs for earlier positions are cancelled.
+        """
+        self.worker.cancel()
+        self.waiting = True
+        self.worker.legal_moves(self.board)
+
+    def receive(self):
+        """
+        Use the results the worker has finished. Called by the main loop when worker_event comes.
+        """
+        for kind, result in self.worker.poll():
+            if kind == "moves":
+                (self.board.moves, self.board.win) = result
+                # All the fields are calculated already, get_moves can use them for this position.
+                self.board.moves_hash = self.board.hash
+                if self.board.win is not None:
+                    self.invalidate()
+                    self.waiting = False
+                elif self.computer == self.board.turn:
+                    self.worker.reply(self.board, self.limits)
+                else:
+                    self.waiting = False
+            elif kind == "error":
+                # Let the player go on instead of waiting for a result that never comes.
+                print("Worker failed: " + type(result).__name__ + ": " + str(result), file=sys.stderr)
+                self.waiting = False
+            else:
+                print(result)
+                if result.move is not None:
+                    self.play(result.move)
+
+    def wake(self):
+        """
+        Tell the main loop that a result of the worker is ready. Called from the worker thread.
+        """
+        pygame.event.post(pygame.event.Event(worker_event))
+
+    def close(self):
+        """
+        Stop the worker, a running search is interrupted.
+        """
+        self.worker.close()
+
 
 class Piece:
     def __init__(self, piece, point):
         """
-        Initialize the given piece and load it image.
+        Initialize the given piece and take its image from the loaded sprites.
         :param piece: Piece type.
         """
         x,y = point
-        if piece == Chess.white_pawn:
-            self.image = pygame.image.load("res/white_pawn.png")
-        elif piece == Chess.white_rook:
-            self.image = pygame.image.load("res/white_rook.png")
-        elif piece == Chess.white_knight:
-            self.image = pygame.image.load("res/white_knight.png")
-        elif piece == Chess.white_king:
-            self.image = pygame.image.load("res/white_king.png")
-        elif piece == Chess.white_queen:
-            self.image = pygame.image.load("res/white_queen.png")
-        elif piece == Chess.white_bishop:
-            self.image = pygame.image.load("res/white_bishop.png")
-        elif piece == Chess.black_pawn:
-            self.image = pygame.image.load("res/black_pawn.png")
-        elif piece == Chess.black_rook:
-            self.image = pygame.image.load("res/black_rook.png")
-        elif piece == Chess.black_knight:
-            self.image = pygame.image.load("res/black_knight.png")
-        elif piece == Chess.black_king:
-            self.image = pygame.image.load("res/black_king.png")
-        elif piece == Chess.black_queen:
-            self.image = pygame.image.load("res/black_queen.png")
-        elif piece == Chess.black_bishop:
-            self.image = pygame.image.load("res/black_bishop.png")
+        self.image = load_sprite(piece.color.lower() + "_" + piece.piece_type.lower())
         self.dragged = False
         self.position = (x, y)
 
+    def rect(self):
+        """
+        Rectangle of the screen covered by the piece, under the mouse when it is dragged.
+        :return: pygame.Rect of the piece.
+        """
+        rect = self.image.get_rect()
+        if self.dragged:
+            rect.center = pygame.mouse.get_pos()
+        else:
+            rect.topleft = (self.position[0] * rect.width, self.position[1] * rect.height)
+        return rect
+
     def display(self, screen):
         """
         Display the piece on the screen.
         :param screen: Screen to display on.
         """
-        if self.dragged:
-            screen.blit(self.image, (pygame.mouse.get_pos()[0] - self.image.get_width() // 2,
-                                     pygame.mouse.get_pos()[1] - self.image.get_height() // 2))
-        else:
-            screen.blit(self.image,
-                        (self.position[0] * self.image.get_width(),
-                         self.position[1] * self.image.get_height()))
+        screen.blit(self.image, self.rect())
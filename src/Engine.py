@@ -0,0 +1,425 @@
+__author__ = 'Maksymilian Mika'
+
+import argparse
+import time
+import Chess
+import Perft
+
+# Values of pieces in the order of Chess.pieces: Pawn, Knight, Bishop, Rook, Queen, King.
+piece_values = [100, 320, 330, 500, 900, 0]
+
+# Bonuses for the field of every piece, seen by white with the eighth row on top.
+piece_square_tables = [
+    [0, 0, 0, 0, 0, 0, 0, 0,
+     50, 50, 50, 50, 50, 50, 50, 50,
+     10, 10, 20, 30, 30, 20, 10, 10,
+     5, 5, 10, 25, 25, 10, 5, 5,
+     0, 0, 0, 20, 20, 0, 0, 0,
+     5, -5, -10, 0, 0, -10, -5, 5,
+     5, 10, 10, -20, -20, 10, 10, 5,
+     0, 0, 0, 0, 0, 0, 0, 0],
+    [-50, -40, -30, -30, -30, -30, -40, -50,
+     -40, -20, 0, 0, 0, 0, -20, -40,
+     -30, 0, 10, 15, 15, 10, 0, -30,
+     -30, 5, 15, 20, 20, 15, 5, -30,
+     -30, 0, 15, 20, 20, 15, 0, -30,
+     -30, 5, 10, 15, 15, 10, 5, -30,
+     -40, -20, 0, 5, 5, 0, -20, -40,
+     -50, -40, -30, -30, -30, -30, -40, -50],
+    [-20, -10, -10, -10, -10, -10, -10, -20,
+     -10, 0, 0, 0, 0, 0, 0, -10,
+     -10, 0, 5, 10, 10, 5, 0, -10,
+     -10, 5, 5, 10, 10, 5, 5, -10,
+     -10, 0, 10, 10, 10, 10, 0, -10,
+     -10, 10, 10, 10, 10, 10, 10, -10,
+     -10, 5, 0, 0, 0, 0, 5, -10,
+     -20, -10, -10, -10, -10, -10, -10, -20],
+    [0, 0, 0, 0, 0, 0, 0, 0,
+     5, 10, 10, 10, 10, 10, 10, 5,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     0, 0, 0, 5, 5, 0, 0, 0],
+    [-20, -10, -10, -5, -5, -10, -10, -20,
+     -10, 0, 0, 0, 0, 0, 0, -10,
+     -10, 0, 5, 5, 5, 5, 0, -10,
+     -5, 0, 5, 5, 5, 5, 0, -5,
+     0, 0, 5, 5, 5, 5, 0, -5,
+     -10, 5, 5, 5, 5, 5, 0, -10,
+     -10, 0, 5, 0, 0, 0, 0, -10,
+     -20, -10, -10, -5, -5, -10, -10, -20],
+    [-30, -40, -40, -50, -50, -40, -40, -30,
+     -30, -40, -40, -50, -50, -40, -40, -30,
+     -30, -40, -40, -50, -50, -40, -40, -30,
+     -30, -40, -40, -50, -50, -40, -40, -30,
+     -20, -30, -30, -40, -40, -30, -30, -20,
+     -10, -20, -20, -20, -20, -20, -20, -10,
+     20, 20, 0, 0, 0, 0, 20, 20,
+     20, 30, 10, 0, 0, 10, 30, 20],
+]
+
+# Value of every piece on every field from the point of view of white, indexed like Chess.pieces.
+square_values = []
+for piece in Chess.pieces:
+    kind = piece.index % 6
+    values = []
+    for index in range(64):
+        x, y = Chess.convert_index(index)
+        if piece.color == "White":
+            values.append(piece_values[kind] + piece_square_tables[kind][(7 - y) * 8 + x])
+        else:
+            values.append(-piece_values[kind] - piece_square_tables[kind][y * 8 + x])
+    square_values.append(values)
+
+mate_score = 100000
+max_ply = 64
+exact = 0
+lower_bound = 1
+upper_bound = 2
+
+
+def evaluate(board):
+    """
+    Static evaluation of the position: material and piece placement.
+    :return: Score in centipawns from the point of view of the player whose turn it is.
+    """
+    score = 0
+    for piece_index, bitboard in enumerate(board.bitboards):
+        values = square_values[piece_index]
+        for index in Chess.iterate_bits(bitboard):
+            score += values[index]
+    if board.turn == "White":
+        return score
+    return -score
+
+
+class Limits:
+    def __init__(self, time=None, nodes=None, depth=None):
+        """
+        Budget of one search. The search stops at whichever limit comes first.
+        :param time: Seconds to think.
+        :param nodes: Number of nodes to visit.
+        :param depth: Deepest iteration.
+        """
+        self.time = time
+        self.nodes = nodes
+        self.depth = depth
+
+
+class SearchResult:
+    def __init__(self):
+        """
+        Outcome of a search, updated after every finished iteration.
+        """
+        self.move = None
+        self.score = 0
+        self.depth = 0
+        self.nodes = 0
+        self.time = 0.0
+        self.pv = []
+
+    @property
+    def nodes_per_second(self):
+        return int(self.nodes / max(self.time, 1e-9))
+
+    def __str__(self):
+        return "depth " + str(self.depth) + " score " + str(self.score) + " nodes " + str(self.nodes) + \
+               " nps " + str(self.nodes_per_second) + " pv " + \
+               " ".join(Perft.move_name(move) for move in self.pv)
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class Engine:
+    def __init__(self, table_size=1 << 18):
+        """
+        Alpha-beta search with iterative deepening. The transposition table and move ordering statistics are kept
+        between searches.
+        :param table_size: Number of entries of the transposition table.
+        """
+        self.table_size = table_size
+        self.table = [None] * table_size
+        self.history = [0] * 4096
+        self.killers = [[0, 0] for ply in range(max_ply)]
+        self.buffers = [Chess.move_buffer() for ply in range(max_ply)]
+        self.nodes = 0
+        self.max_nodes = None
+        self.deadline = None
+        self.stop = None
+        self.stack = []
+        self.path = []
+        self.root_move = 0
+
+    def search(self, board, limits=None, report=None, stop=None):
+        """
+        Find the best move of the player whose turn it is. The board is left unchanged.
+        :param limits: Limits of the search, one second when not given.
+        :param report: Called with the result after every finished iteration.
+        :param stop: threading.Event that ends the search early when set from another thread.
+        :return: SearchResult. Its move is None when there are no legal moves.
+        """
+        if limits is None:
+            limits = Limits(time=1.0)
+        start = time.perf_counter()
+        self.nodes = 0
+        self.max_nodes = limits.nodes
+        self.stop = stop
+        self.deadline = None
+        if limits.time is not None:
+            self.deadline = start + limits.time
+        self.killers = [[0, 0] for ply in range(max_ply)]
+        self.history = [value // 8 for value in self.history]
+        self.root_move = 0
+        result = SearchResult()
+        max_depth = max_ply - 1
+        if limits.depth is not None:
+            max_depth = min(limits.depth, max_depth)
+        for depth in range(1, max_depth + 1):
+            try:
+                score = self.negamax(board, depth, -mate_score - 1, mate_score + 1, 0)
+            except SearchTimeout:
+                while self.stack:
+                    board.unmake_move(self.stack.pop())
+                self.path = []
+                if result.move is None and self.root_move:
+                    result.move = Chess.decode_move(self.root_move)
+                break
+            result.move = None
+            if self.root_move:
+                result.move = Chess.decode_move(self.root_move)
+            result.score = score
+            result.depth = depth
+            result.pv = self.principal_variation(board, depth)
+            result.nodes = self.nodes
+            result.time = time.perf_counter() - start
+            if report is not None:
+                report(result)
+            if result.move is None or abs(score) > mate_score - max_ply:
+                break
+        result.nodes = self.nodes
+        result.time = time.perf_counter() - start
+        return result
+
+    def principal_variation(self, board, depth):
+        """
+        Follow the best moves stored in the transposition table.
+        :return: List of moves.
+        """
+        moves = []
+        undos = []
+        buffer = Chess.move_buffer()
+        for ply in range(depth):
+            entry = self.table[board.hash % self.table_size]
+            if entry is None or entry[0] != board.hash or not entry[4]:
+                break
+            count = board.generate_moves(buffer)
+            if entry[4] not in buffer[:count]:
+                break
+            moves.append(Chess.decode_move(entry[4]))
+            undos.append(board.make_encoded_move(entry[4]))
+        while undos:
+            board.unmake_move(undos.pop())
+        return moves
+
+    def order_moves(self, board, moves, count, best_move, ply):
+        """
+        Sort moves so the most promising are searched first: the move from the transposition table, captures of
+        the most valuable victims by the least valuable attackers, promotions, killer moves and then quiet moves
+        by their history. Captures that lose the exchange come last.
+        :return: List of moves.
+        """
+        table = board.table
+        killers = self.killers[ply]
+        history = self.history
+        scored = []
+        for i in range(count):
+            move = moves[i]
+            if move == best_move:
+                key = 1 << 30
+            else:
+                target = table[move >> 6 & 63]
+                if target is not None and target.color != board.turn:
+                    key = (1 << 24) + (target.index % 6) * 8 - table[move & 63].index % 6
+                    # A capture of a cheaper piece that loses the exchange goes after the quiet moves.
+                    if piece_values[target.index % 6] < piece_values[table[move & 63].index % 6] and \
+                            board.see(move) < 0:
+                        key = -1
+                elif move >> 12 & Chess.promotion_flag:
+                    key = (1 << 24) + (move >> 12 & 3)
+                elif move >> 12 == Chess.en_passant_flag:
+                    key = 1 << 24
+                elif move == killers[0] or move == killers[1]:
+                    key = 1 << 22
+                else:
+                    key = history[move & 4095]
+            scored.append((key, move))
+        scored.sort(reverse=True)
+        return [move for key, move in scored]
+
+    def check_limits(self):
+        # The node limit is checked on every node, this only takes the slower checks of time and the stop event.
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchTimeout()
+        if self.stop is not None and self.stop.is_set():
+            raise SearchTimeout()
+
+    def negamax(self, board, depth, alpha, beta, ply):
+        """
+        Alpha-beta search of the position.
+        :return: Score from the point of view of the player whose turn it is.
+        """
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            raise SearchTimeout()
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.check_limits()
+        if ply and board.hash in self.path:
+            return 0
+        checked = board.king_checked
+        if checked:
+            depth += 1
+        if depth <= 0 or ply >= max_ply - 1:
+            return self.quiescence(board, alpha, beta, ply)
+        entry = self.table[board.hash % self.table_size]
+        best_move = 0
+        if entry is not None and entry[0] == board.hash:
+            best_move = entry[4]
+            if entry[1] >= depth and ply:
+                score = entry[2]
+                if score > mate_score - max_ply:
+                    score -= ply
+                elif score < -mate_score + max_ply:
+                    score += ply
+                if entry[3] == exact or entry[3] == lower_bound and score >= beta or \
+                        entry[3] == upper_bound and score <= alpha:
+                    return score
+        buffer = self.buffers[ply]
+        count = board.generate_moves(buffer)
+        if count == 0:
+            if checked:
+                return -mate_score + ply
+            return 0
+        original_alpha = alpha
+        best = -mate_score - 1
+        self.path.append(board.hash)
+        for move in self.order_moves(board, buffer, count, best_move, ply):
+            quiet = board.table[move >> 6 & 63] is None and not move >> 12 & (Chess.promotion_flag |
+                                                                              Chess.en_passant_flag)
+            self.stack.append(board.make_encoded_move(move))
+            score = -self.negamax(board, depth - 1, -beta, -alpha, ply + 1)
+            board.unmake_move(self.stack.pop())
+            if score > best:
+                best = score
+                best_move = move
+                if ply == 0:
+                    self.root_move = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if quiet:
+                            killers = self.killers[ply]
+                            if killers[0] != move:
+                                killers[1] = killers[0]
+                                killers[0] = move
+                            self.history[move & 4095] += depth * depth
+                        break
+        self.path.pop()
+        if best <= original_alpha:
+            flag = upper_bound
+        elif best >= beta:
+            flag = lower_bound
+        else:
+            flag = exact
+        stored = best
+        if stored > mate_score - max_ply:
+            stored += ply
+        elif stored < -mate_score + max_ply:
+            stored -= ply
+        self.table[board.hash % self.table_size] = (board.hash, depth, stored, flag, best_move)
+        return best
+
+    def quiescence(self, board, alpha, beta, ply):
+        """
+        Search only captures and promotions until the position is quiet, so the evaluation is not taken in the
+        middle of an exchange. When checked all moves are searched.
+        :return: Score from the point of view of the player whose turn it is.
+        """
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            raise SearchTimeout()
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.check_limits()
+        checked = board.king_checked
+        if not checked:
+            stand = evaluate(board)
+            if stand >= beta or ply >= max_ply - 1:
+                return stand
+            if stand > alpha:
+                alpha = stand
+        elif ply >= max_ply - 1:
+            return evaluate(board)
+        buffer = self.buffers[ply]
+        count = board.generate_moves(buffer)
+        if count == 0:
+            if checked:
+                return -mate_score + ply
+            return 0
+        for move in self.order_moves(board, buffer, count, 0, ply):
+            if not checked:
+                target = board.table[move >> 6 & 63]
+                if (target is None or target.color == board.turn) and \
+                        not move >> 12 & (Chess.promotion_flag | Chess.en_passant_flag):
+                    continue
+                # Captures that lose material in the exchange can not raise the score above standing pat.
+                if board.see(move) < 0:
+                    continue
+            self.stack.append(board.make_encoded_move(move))
+            score = -self.quiescence(board, -beta, -alpha, ply + 1)
+            board.unmake_move(self.stack.pop())
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+
+default_engine = None
+
+
+def search(board, limits=None, report=None):
+    """
+    Search with an engine shared by all calls, so its transposition table is reused.
+    :return: SearchResult.
+    """
+    global default_engine
+    if default_engine is None:
+        default_engine = Engine()
+    return default_engine.search(board, limits, report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the best move of a position.")
+    parser.add_argument("--fen", default=None, help="position to search, the starting position when not given")
+    parser.add_argument("--time", type=float, default=None, help="seconds to think")
+    parser.add_argument("--nodes", type=int, default=None, help="nodes to search")
+    parser.add_argument("--depth", type=int, default=None, help="deepest iteration")
+    args = parser.parse_args()
+
+    if args.time is None and args.nodes is None and args.depth is None:
+        args.time = 5.0
+    board = Chess.Board(args.fen)
+    result = search(board, Limits(args.time, args.nodes, args.depth), print)
+    if result.move is not None:
+        print("best move " + Perft.move_name(result.move) + " in " + "%.3f" % result.time + "s")
+    elif board.king_checked:
+        print("no moves, checkmate")
+    else:
+        print("no moves, stalemate")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+__author__ = 'Maksymilian Mika'
+
+import argparse
+import sys
+import time
+import Chess
+
+
+def parse_epd(line):
+    """
+    Split one EPD line into the position and its operations.
+    :param line: Example: rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 id "start";
+    :return: Pair (fen, operations) where operations is a dictionary from opcode to operand string. String operands
+    are given without their quotes.
+    """
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("Invalid EPD: " + line)
+    operations = {}
+    rest = fields[4] if len(fields) == 5 else ""
+    counters = rest.split(None, 2)
+    if len(counters) >= 2 and counters[0].isdigit() and counters[1].isdigit():
+        # A full FEN line, the move counters are not operations.
+        rest = counters[2] if len(counters) == 3 else ""
+    for operation in rest.split(";"):
+        operation = operation.strip()
+        if operation:
+            opcode, _, operand = operation.partition(" ")
+            operand = operand.strip()
+            if len(operand) >= 2 and operand.startswith('"') and operand.endswith('"'):
+                operand = operand[1:-1]
+            operations[opcode] = operand
+    return " ".join(fields[:4]), operations
+
+
+def read_epd(file, board=None, on_error=None):
+    """
+    Lazily read positions from an EPD (or FEN per line) file. Only one line is held in memory at a time.
+    :param file: Opened text file or any iterable of lines.
+    :param board: Board to set up for every line. It is reused, so keep a copy of anything needed later.
+    :param on_error: Called with line number and the ValueError for invalid lines, which are then skipped. When not
+    given the error is raised.
+    :return: Generator of triples (line number, board, operations). Empty and comment lines are skipped.
+    """
+    if board is None:
+        board = Chess.Board()
+    for number, line in enumerate(file, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            fen, operations = parse_epd(line)
+            board.set_fen(fen)
+        except ValueError as error:
+            if on_error is None:
+                raise
+            on_error(number, error)
+            continue
+        yield number, board, operations
+
+
+def position_status(board, buffer):
+    """
+    Count the legal moves of the position and tell how the game stands.
+    :param buffer: Move buffer created by Chess.move_buffer.
+    :return: Pair (number of legal moves, status) where status is checkmate, stalemate, check or normal.
+    """
+    count = board.generate_moves(buffer)
+    checked = board.king_checked
+    if count == 0:
+        if checked:
+            return 0, "checkmate"
+        return 0, "stalemate"
+    if checked:
+        return count, "check"
+    return count, "normal"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count legal moves and find mates in every position of EPD files.")
+    parser.add_argument("files", nargs="*", default=["-"], help="EPD files, - for the standard input")
+    parser.add_argument("--output", default="-", help="file for the results, - for the standard output")
+    args = parser.parse_args()
+
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    buffer = Chess.move_buffer()
+    board = Chess.Board()
+    positions = 0
+    errors = []
+    start = time.perf_counter()
+    for name in args.files:
+        file = sys.stdin if name == "-" else open(name, buffering=1 << 20)
+
+        def on_error(number, error):
+            print(name + ":" + str(number) + ": " + str(error), file=sys.stderr)
+            errors.append(number)
+
+        for number, board, operations in read_epd(file, board, on_error):
+            count, status = position_status(board, buffer)
+            output.write(name + ":" + str(number) + "\t" + str(count) + "\t" + status + "\t" +
+                         operations.get("id", "") + "\n")
+            positions += 1
+        if file is not sys.stdin:
+            file.close()
+    elapsed = time.perf_counter() - start
+    print(str(positions) + " positions, " + str(len(errors)) + " errors in " + "%.3f" % elapsed + "s (" +
+          str(int(positions / max(elapsed, 1e-9))) + " positions/s)", file=sys.stderr)
+    if output is not sys.stdout:
+        output.close()
+
+
+if __name__ == "__main__":
+    main()
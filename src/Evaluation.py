@@ -0,0 +1,213 @@
+__author__ = 'Maksymilian Mika'
+
+import argparse
+import sys
+import time
+import numpy
+import Chess
+import Engine
+import Epd
+
+# Material and piece-square values of Engine, as arrays indexed [piece index, field index], seen by white.
+material_values = numpy.array([Engine.piece_values[piece.index % 6] * (1 if piece.color == "White" else -1)
+                               for piece in Chess.pieces], dtype=numpy.int32)
+square_tables = numpy.array(Engine.square_values, dtype=numpy.int32) - material_values[:, None]
+
+mobility_weight = 4
+shield_weight = 10
+attacker_weight = 8
+
+
+def bitboard_matrix(bitboards):
+    """
+    Turn a list of 64 bitboards into a 64x64 matrix, row i holding the bits of bitboard i.
+    :return: Array of 0 and 1.
+    """
+    data = b"".join(bitboard.to_bytes(8, "little") for bitboard in bitboards)
+    return numpy.unpackbits(numpy.frombuffer(data, dtype=numpy.uint8), bitorder="little").reshape(64, 64)
+
+
+knight_matrix = bitboard_matrix(Chess.knight_attacks).astype(numpy.float32)
+# Fields on every ray, nearest first. Fields past the edge point to the extra field 64 that is always occupied,
+# the last column is always past the edge so every ray has a blocker.
+ray_fields = {}
+for direction in Chess.queen_directions:
+    fields = numpy.full((64, 8), 64, dtype=numpy.intp)
+    for index in range(64):
+        point = Chess.convert_index(index)
+        for step in range(7):
+            point = Chess.add_vectors(point, direction)
+            if not Chess.check_bounds(point):
+                break
+            fields[index, step] = Chess.convert_point(point)
+    ray_fields[direction] = fields
+# Fields right in front of the king where own pawns shelter it, and fields near the king.
+shield_matrices = {}
+for color, forward in (("White", 1), ("Black", -1)):
+    shield = []
+    for index in range(64):
+        x, y = Chess.convert_index(index)
+        bitboard = 0
+        for dx in (-1, 0, 1):
+            if Chess.check_bounds((x + dx, y + forward)):
+                bitboard |= 1 << Chess.convert_point((x + dx, y + forward))
+        shield.append(bitboard)
+    shield_matrices[color] = bitboard_matrix(shield).astype(numpy.float32)
+king_zone_matrix = bitboard_matrix([Chess.step_attacks(Chess.king_attacks[index], Chess.king_directions) |
+                                    Chess.king_attacks[index] for index in range(64)]).astype(numpy.float32)
+
+
+def board_bytes(board):
+    """
+    Raw bytes of the twelve bitboards of the board, the form collected by pack_bytes.
+    :return: 96 bytes.
+    """
+    return b"".join(bitboard.to_bytes(8, "little") for bitboard in board.bitboards)
+
+
+def pack_bytes(data, turns):
+    """
+    Turn bytes from board_bytes of many boards into arrays.
+    :param data: Concatenated results of board_bytes.
+    :param turns: List of colors whose turn it is, one for every board.
+    :return: Pair (planes, turns). planes is array of shape (N, 12, 64) with 1 where the piece (indexed like
+    Chess.pieces) stands on the field (indexed like Board.table). turns is array of 1 for white and -1 for black.
+    """
+    planes = numpy.unpackbits(numpy.frombuffer(data, dtype=numpy.uint8), bitorder="little")
+    turns = numpy.array([1 if turn == "White" else -1 for turn in turns], dtype=numpy.int32)
+    return planes.reshape(-1, 12, 64), turns
+
+
+def pack_boards(boards):
+    """
+    Pack boards into arrays for evaluate_planes.
+    :return: Pair (planes, turns) as from pack_bytes.
+    """
+    boards = list(boards)
+    return pack_bytes(b"".join(board_bytes(board) for board in boards), [board.turn for board in boards])
+
+
+def slider_mobility(planes, sides, occupied, directions, slider):
+    """
+    Count the moves of sliding pieces of both colors in all positions at once. Only fields with the pieces are
+    looked at, so the work grows with the number of pieces rather than fields.
+    :param planes: Array (N, 12, 64) from pack_boards.
+    :param sides: Dictionary from color to array (N, 65) of True on fields of its pieces.
+    :param occupied: Array (N, 65) of True on occupied fields, the extra field is always occupied.
+    :param directions: Directions the pieces slide in.
+    :param slider: Index of the piece sliding in these directions besides the queen. Example: 3 for rooks
+    :return: Array (N,) of white moves minus black moves.
+    """
+    position, piece, field = numpy.nonzero(planes[:, [slider, 4, 6 + slider, 10]])
+    white = piece < 2
+    moves = numpy.zeros(len(position), dtype=numpy.int32)
+    entries = numpy.arange(len(position))
+    for direction in directions:
+        fields = ray_fields[direction][field]
+        # The first occupied field on the ray stops the piece, a move further is a capture of an enemy piece.
+        free = occupied[position[:, None], fields].argmax(axis=1)
+        blocker = fields[entries, free]
+        capture = numpy.where(white, sides["Black"][position, blocker], sides["White"][position, blocker])
+        moves += free + capture
+    return numpy.bincount(position, weights=numpy.where(white, moves, -moves), minlength=len(planes))
+
+
+def evaluation_terms(planes):
+    """
+    Calculate the evaluation terms of many positions with array operations.
+    :param planes: Array (N, 12, 64) from pack_boards.
+    :return: Dictionary from term name (material, piece_square, mobility, king_safety) to array (N,) of scores in
+    centipawns seen by white.
+    """
+    count = len(planes)
+    pieces = planes.astype(numpy.float32)
+    edge = numpy.zeros((count, 1), dtype=bool)
+    sides = {"White": numpy.concatenate([planes[:, :6].any(axis=1), edge], axis=1),
+             "Black": numpy.concatenate([planes[:, 6:].any(axis=1), edge], axis=1)}
+    occupied = sides["White"] | sides["Black"]
+    occupied[:, 64] = True
+
+    material = planes.sum(axis=2, dtype=numpy.int32) @ material_values
+    piece_square = numpy.einsum("npi,pi->n", pieces, square_tables.astype(numpy.float32))
+
+    mobility = numpy.zeros(count, dtype=numpy.float32)
+    for color, offset, sign in (("White", 0, 1), ("Black", 6, -1)):
+        knight_targets = pieces[:, offset + 1] @ knight_matrix
+        mobility += sign * (knight_targets * ~sides[color][:, :64]).sum(axis=1)
+    mobility += slider_mobility(planes, sides, occupied, Chess.bishop_directions, 2)
+    mobility += slider_mobility(planes, sides, occupied, Chess.rook_directions, 3)
+
+    king_safety = numpy.zeros(count, dtype=numpy.float32)
+    for color, offset, sign in (("White", 0, 1), ("Black", 6, -1)):
+        enemy_offset = 6 - offset
+        king = pieces[:, offset + 5]
+        shield = ((king @ shield_matrices[color]) * pieces[:, offset]).sum(axis=1)
+        enemy_pieces = pieces[:, enemy_offset + 1:enemy_offset + 5].sum(axis=1)
+        attackers = ((king @ king_zone_matrix) * enemy_pieces).sum(axis=1)
+        king_safety += sign * (shield_weight * shield - attacker_weight * attackers)
+
+    return {"material": material,
+            "piece_square": piece_square.round().astype(numpy.int32),
+            "mobility": mobility_weight * mobility.round().astype(numpy.int32),
+            "king_safety": king_safety.round().astype(numpy.int32)}
+
+
+def evaluate_planes(planes, turns):
+    """
+    Evaluate many packed positions.
+    :return: Array (N,) of scores in centipawns from the point of view of the player whose turn it is.
+    """
+    return sum(evaluation_terms(planes).values()) * turns
+
+
+def evaluate_boards(boards):
+    """
+    Evaluate many boards at once.
+    :return: Array (N,) of scores in centipawns from the point of view of the player whose turn it is.
+    """
+    return evaluate_planes(*pack_boards(boards))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate every position of EPD files.")
+    parser.add_argument("files", nargs="*", default=["-"], help="EPD files, - for the standard input")
+    parser.add_argument("--batch", type=int, default=4096, help="positions evaluated at once")
+    args = parser.parse_args()
+
+    def flush():
+        scores = evaluate_planes(*pack_bytes(b"".join(data), turns))
+        for name, score in zip(names, scores):
+            sys.stdout.write(name + "\t" + str(score) + "\n")
+        del data[:], turns[:], names[:]
+
+    data = []
+    turns = []
+    names = []
+    positions = 0
+    errors = []
+    start = time.perf_counter()
+    for name in args.files:
+        file = sys.stdin if name == "-" else open(name, buffering=1 << 20)
+
+        def on_error(number, error):
+            print(name + ":" + str(number) + ": " + str(error), file=sys.stderr)
+            errors.append(number)
+
+        for number, board, operations in Epd.read_epd(file, None, on_error):
+            data.append(board_bytes(board))
+            turns.append(board.turn)
+            names.append(name + ":" + str(number))
+            positions += 1
+            if len(data) == args.batch:
+                flush()
+        if file is not sys.stdin:
+            file.close()
+    if data:
+        flush()
+    elapsed = time.perf_counter() - start
+    print(str(positions) + " positions, " + str(len(errors)) + " errors in " + "%.3f" % elapsed + "s (" +
+          str(int(positions / max(elapsed, 1e-9))) + " positions/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
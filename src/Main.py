@@ -1,27 +1,51 @@
 __author__ = 'Maksymilian Mika'
 
 import sys, pygame
+import argparse
+import Book
 import Display
+import Engine
+
+parser = argparse.ArgumentParser(description="Play chess.")
+parser.add_argument("--computer", choices=["White", "Black"], default=None, help="color played by the computer")
+parser.add_argument("--think-time", type=float, default=2.0, help="seconds the computer thinks per move")
+parser.add_argument("--book", default=None, help="opening book the computer plays from")
+parser.add_argument("--fps", type=int, default=60, help="most frames drawn per second")
+args = parser.parse_args()
 
 pygame.init()
 pygame.font.init()
 size = width, height = 60*8, 60*8
-black = 0, 0, 0
 screen = pygame.display.set_mode(size)
 
-board_display = Display.BoardDisplay()
+book = None
+if args.book is not None:
+    book = Book.Book(args.book)
+board_display = Display.BoardDisplay(args.computer, Engine.Limits(time=args.think_time), book)
 
-set = False
+clock = pygame.time.Clock()
 
 while 1:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT: sys.exit()
+        if board_display.animating():
+            events = pygame.event.get()
+        else:
+            # Nothing changes until the player does something, so sleep until then. Dragging wakes the loop
+            # with mouse motion events.
+            events = [pygame.event.wait()] + pygame.event.get()
+        for event in events:
+            if event.type == pygame.QUIT:
+                board_display.close()
+                sys.exit()
             if event.type == pygame.MOUSEBUTTONDOWN:
                 board_display.dragged(pygame.mouse.get_pos())
             if event.type == pygame.MOUSEBUTTONUP:
                 board_display.dropped(pygame.mouse.get_pos())
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                board_display.invalidate()
+            if event.type == Display.worker_event:
+                board_display.receive()
 
-    
-        screen.fill(black)
-        board_display.display(screen)
-        pygame.display.flip()
+        rects = board_display.display(screen)
+        if rects:
+            pygame.display.update(rects)
+        clock.tick(args.fps)
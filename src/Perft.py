@@ -0,0 +1,121 @@
+__author__ = 'Maksymilian Mika'
+
+import argparse
+import sys
+import time
+import Chess
+
+start_fen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# Well known positions with their node counts for depths 1, 2, 3...
+reference_positions = [
+    (start_fen, [20, 400, 8902, 197281]),
+    ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039, 97862]),
+    ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238]),
+    ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 264, 9467]),
+    ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379]),
+]
+
+
+def move_name(move):
+    """
+    Describe the move in coordinate notation. Castles are written as the king taking its own rook.
+    :param move: Move as returned by Board.legal_moves. Example: ((4, 1), (4, 3))
+    :return: String describing the move. Example: e2e4
+    """
+    name = ""
+    for x, y in move[:2]:
+        name += "abcdefgh"[x] + str(y + 1)
+    if len(move) == 3:
+        name += move[2][0].lower() if move[2] != "Knight" else "n"
+    return name
+
+
+def perft(board, depth, buffers=None):
+    """
+    Count the leaf nodes of the move tree of given depth.
+    :param board: Board to search from. It is left unchanged.
+    :param depth: Depth of the tree.
+    :param buffers: Move buffers, one for every depth. Created when not given.
+    :return: Number of leaf nodes.
+    """
+    if depth == 0:
+        return 1
+    if buffers is None:
+        buffers = [Chess.move_buffer() for i in range(depth)]
+    moves = buffers[depth - 1]
+    count = board.generate_moves(moves)
+    if depth == 1:
+        return count
+    nodes = 0
+    for i in range(count):
+        undo = board.make_encoded_move(moves[i])
+        nodes += perft(board, depth - 1, buffers)
+        board.unmake_move(undo)
+    return nodes
+
+
+def divide(board, depth):
+    """
+    Count the leaf nodes separately for every move from the root.
+    :return: List of pairs (move, nodes).
+    """
+    result = []
+    for move in board.legal_moves():
+        undo = board.make_move(*move)
+        result.append((move, perft(board, depth - 1)))
+        board.unmake_move(undo)
+    return result
+
+
+def check_reference(max_depth):
+    """
+    Compare node counts of the reference positions with the known values.
+    :param max_depth: Deepest depth to check.
+    :return: True if all counts match.
+    """
+    correct = True
+    for fen, counts in reference_positions:
+        board = Chess.Board(fen)
+        for depth, expected in enumerate(counts[:max_depth], 1):
+            nodes = perft(board, depth)
+            if nodes != expected:
+                print(fen + " depth " + str(depth) + ": " + str(nodes) + " nodes, expected " + str(expected))
+                correct = False
+    if correct:
+        print("all reference positions match")
+    return correct
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count move generation nodes and measure their speed.")
+    parser.add_argument("--depth", type=int, default=3, help="depth of the search")
+    parser.add_argument("--fen", default=start_fen, help="position to start from")
+    parser.add_argument("--divide", action="store_true", help="print node counts for every root move")
+    parser.add_argument("--reference", action="store_true",
+                        help="check node counts of well known positions up to the depth")
+    args = parser.parse_args()
+
+    if args.reference:
+        sys.exit(0 if check_reference(args.depth) else 1)
+
+    board = Chess.Board(args.fen)
+    if args.divide:
+        total = 0
+        start = time.perf_counter()
+        for move, nodes in divide(board, args.depth):
+            print(move_name(move) + ": " + str(nodes))
+            total += nodes
+        elapsed = time.perf_counter() - start
+        print("total: " + str(total) + " (" + str(int(total / max(elapsed, 1e-9))) + " nodes/s)")
+        return
+    for depth in range(1, args.depth + 1):
+        start = time.perf_counter()
+        nodes = perft(board, depth)
+        elapsed = time.perf_counter() - start
+        print("depth " + str(depth) + ": " + str(nodes) + " nodes in " + "%.3f" % elapsed + "s (" +
+              str(int(nodes / max(elapsed, 1e-9))) + " nodes/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+__author__ = 'Maksymilian Mika'
+
+import argparse
+import collections
+import itertools
+import multiprocessing
+import queue
+import re
+import sys
+import time
+import Chess
+
+san_pieces = {"K": "King", "Q": "Queen", "R": "Rook", "B": "Bishop", "N": "Knight"}
+piece_letters = {"King": "K", "Queen": "Q", "Rook": "R", "Bishop": "B", "Knight": "N", "Pawn": ""}
+results = {"1-0", "0-1", "1/2-1/2", "*"}
+tag_pattern = re.compile(r'\[(\w+)\s+"((?:[^"\\]|\\.)*)"\]')
+# Comments, variations, numeric annotations and move numbers are skipped by the tokenizer.
+token_pattern = re.compile(r'\{[^}]*\}|;[^\n]*|\(|\)|\$\d+|\d+\.(?:\.\.)?|[^\s(){};]+')
+
+
+def read_game_texts(file):
+    """
+    Split a PGN file into the texts of single games without parsing them. Only one game is held in memory at a time.
+    :param file: Opened text file or any iterable of lines.
+    :return: Generator of game texts.
+    """
+    lines = []
+    moves_seen = False
+    for line in file:
+        if line.startswith("[") and moves_seen:
+            yield "".join(lines)
+            lines = []
+            moves_seen = False
+        if line.strip() and not line.startswith("["):
+            moves_seen = True
+        lines.append(line)
+    if "".join(lines).strip():
+        yield "".join(lines)
+
+
+def parse_game(text):
+    """
+    Read tags and moves of one game.
+    :param text: Text of the game in PGN.
+    :return: Triple (tags, moves, result). tags is a dictionary, moves list of moves in SAN.
+    """
+    tags = {}
+    movetext = []
+    for line in text.splitlines():
+        if line.startswith("["):
+            match = tag_pattern.match(line)
+            if match:
+                tags[match.group(1)] = match.group(2)
+        else:
+            movetext.append(line)
+    moves = []
+    result = tags.get("Result", "*")
+    depth = 0
+    for token in token_pattern.findall("\n".join(movetext)):
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth or token[0] in "{;$" or token[0].isdigit() and token.endswith("."):
+            continue
+        elif token in results:
+            result = token
+        else:
+            moves.append(token)
+    return tags, moves, result
+
+
+def san_move(board, san, moves=None):
+    """
+    Find the move written in SAN among the legal moves of the board.
+    :param san: Move in SAN. Example: Nbd7
+    :param moves: Legal moves of the board, calculated when not given.
+    :return: Move as used by Board.make_move.
+    """
+    if moves is None:
+        moves = board.legal_moves()
+    text = san.rstrip("+#!?")
+    if board.turn == "White":
+        row = 0
+    else:
+        row = 7
+    if text in ("O-O", "0-0"):
+        move = ((4, row), (7, row))
+        if move in moves:
+            return move
+        raise ValueError("Illegal move: " + san)
+    if text in ("O-O-O", "0-0-0"):
+        move = ((4, row), (0, row))
+        if move in moves:
+            return move
+        raise ValueError("Illegal move: " + san)
+    promotion = None
+    if "=" in text:
+        text, promotion = text.split("=", 1)
+    elif len(text) > 2 and text[-1] in "QRBN" and text[-2].isdigit():
+        text, promotion = text[:-1], text[-1]
+    if promotion is not None:
+        if promotion not in san_pieces or promotion == "K":
+            raise ValueError("Invalid move: " + san)
+        promotion = san_pieces[promotion]
+    piece_type = "Pawn"
+    if text and text[0] in san_pieces:
+        piece_type = san_pieces[text[0]]
+        text = text[1:]
+    text = text.replace("x", "").replace("-", "")
+    if len(text) < 2 or text[-2] not in "abcdefgh" or text[-1] not in "12345678":
+        raise ValueError("Invalid move: " + san)
+    target = ("abcdefgh".index(text[-2]), int(text[-1]) - 1)
+    hint = text[:-2]
+    found = None
+    for move in moves:
+        (previous, next) = move[:2]
+        if next != target:
+            continue
+        field = board.table[Chess.convert_point(previous)]
+        captured = board.table[Chess.convert_point(next)]
+        if field.piece_type != piece_type or captured is not None and captured.color == field.color:
+            continue
+        if len(move) == 3:
+            move_promotion = move[2]
+        else:
+            move_promotion = None
+        if move_promotion != promotion:
+            continue
+        if not all(char == "abcdefgh"[previous[0]] or char == str(previous[1] + 1) for char in hint):
+            continue
+        if found is not None:
+            raise ValueError("Ambiguous move: " + san)
+        found = move
+    if found is None:
+        raise ValueError("Illegal move: " + san)
+    return found
+
+
+def move_san(board, move, moves=None):
+    """
+    Write the legal move in SAN.
+    :param move: Move as used by Board.make_move.
+    :param moves: Legal moves of the board, calculated when not given.
+    :return: Move in SAN. Example: exd8=Q+
+    """
+    if moves is None:
+        moves = board.legal_moves()
+    (previous, next) = move[:2]
+    field = board.table[Chess.convert_point(previous)]
+    target = board.table[Chess.convert_point(next)]
+    if target is not None and target.color == field.color:
+        if next[0] == 0:
+            san = "O-O-O"
+        else:
+            san = "O-O"
+    else:
+        name = "abcdefgh"[next[0]] + str(next[1] + 1)
+        capture = target is not None or field.piece_type == "Pawn" and previous[0] != next[0]
+        if field.piece_type == "Pawn":
+            san = ""
+            if capture:
+                san = "abcdefgh"[previous[0]] + "x"
+            san += name
+            if len(move) == 3:
+                san += "=" + piece_letters[move[2]]
+        else:
+            others = [other[0] for other in moves if other[1] == next and other[0] != previous and
+                      board.table[Chess.convert_point(other[0])] == field]
+            san = piece_letters[field.piece_type]
+            if others:
+                if all(other[0] != previous[0] for other in others):
+                    san += "abcdefgh"[previous[0]]
+                elif all(other[1] != previous[1] for other in others):
+                    san += str(previous[1] + 1)
+                else:
+                    san += "abcdefgh"[previous[0]] + str(previous[1] + 1)
+            if capture:
+                san += "x"
+            san += name
+    undo = board.make_move(*move)
+    if board.king_checked:
+        if board.legal_moves():
+            san += "+"
+        else:
+            san += "#"
+    board.unmake_move(undo)
+    return san
+
+
+def error_message(error):
+    """
+    Describe why a game failed. Invalid games raise ValueError, anything else also gets the name of the exception.
+    :param error: Exception raised while replaying the game.
+    :return: Text for the error of the report.
+    """
+    if isinstance(error, ValueError):
+        return str(error)
+    return type(error).__name__ + ": " + str(error)
+
+
+def replay_game(text):
+    """
+    Replay one game, checking that every move is legal.
+    :param text: Text of the game in PGN.
+    :return: Dictionary describing the game: tags, result, plies, moves rewritten in SAN, codes of the moves as from
+    Board.move_code, error and the final fen. A failure of the game is put in error and never raised, so one
+    broken game does not stop the others.
+    """
+    tags, moves, result = parse_game(text)
+    report = {"tags": tags, "result": result, "plies": 0, "moves": [], "codes": [], "error": None}
+    try:
+        if tags.get("SetUp") == "1" and "FEN" in tags:
+            board = Chess.Board(tags["FEN"])
+        else:
+            board = Chess.Board()
+    except Exception as error:
+        report["error"] = error_message(error)
+        return report
+    for san in moves:
+        try:
+            legal = board.legal_moves()
+            move = san_move(board, san, legal)
+            name = move_san(board, move, legal)
+            code = board.move_code(move)
+            board.make_move(*move)
+        except Exception as error:
+            report["error"] = "ply " + str(report["plies"] + 1) + ": " + error_message(error)
+            break
+        report["moves"].append(name)
+        report["codes"].append(code)
+        report["plies"] += 1
+    report["fen"] = board.fen()
+    return report
+
+
+def replay_chunk(chunk):
+    """
+    Replay games together with their numbers, so results can be matched with the games in any order.
+    :param chunk: List of pairs (number, text).
+    :return: List of pairs (number, result of replay_game).
+    """
+    return [(number, replay_game(text)) for number, text in chunk]
+
+
+def validate_games(texts, processes=None, chunksize=32, ordered=True):
+    """
+    Replay games in a pool of processes. Games are sent in chunks and read lazily. A limited number of chunks is
+    in flight and a new one is sent as soon as one finishes, so the workers are kept busy and any number of games
+    can be validated in constant memory.
+    :param texts: Iterable of game texts, for example from read_game_texts.
+    :param processes: Number of worker processes, all processors when not given.
+    :param chunksize: Number of games sent to a worker at once.
+    :param ordered: If the results should come in the order of the games. Otherwise they come as soon as ready.
+    :return: Generator of pairs (game number counted from 1, result of replay_game).
+    """
+    numbered = enumerate(texts, 1)
+    limit = (processes or multiprocessing.cpu_count()) * 4
+    # Chunks in the order they were sent, for ordered results.
+    pending = collections.deque()
+    # Results or exceptions of chunks in the order they finished, for unordered results.
+    finished = queue.Queue()
+    running = 0
+    with multiprocessing.Pool(processes) as pool:
+        while True:
+            while running < limit:
+                chunk = list(itertools.islice(numbered, chunksize))
+                if not chunk:
+                    break
+                if ordered:
+                    pending.append(pool.apply_async(replay_chunk, (chunk,)))
+                else:
+                    pool.apply_async(replay_chunk, (chunk,), callback=finished.put, error_callback=finished.put)
+                running += 1
+            if running == 0:
+                break
+            running -= 1
+            if ordered:
+                yield from pending.popleft().get()
+            else:
+                reports = finished.get()
+                if isinstance(reports, BaseException):
+                    raise reports
+                yield from reports
+
+
+def annotated_game(report):
+    """
+    Write the replayed game back in PGN, with the moves in standard SAN.
+    :param report: Result of replay_game.
+    :return: Text of the game.
+    """
+    text = ""
+    for name, value in report["tags"].items():
+        text += "[" + name + " \"" + value + "\"]\n"
+    movetext = []
+    black_first = report["tags"].get("FEN", " w ").split()[1:2] == ["b"]
+    for ply, san in enumerate(report["moves"], black_first):
+        if ply % 2 == 0:
+            movetext.append(str(ply // 2 + 1) + ". " + san)
+        elif ply == 1 and black_first:
+            movetext.append("1... " + san)
+        else:
+            movetext.append(san)
+    movetext.append(report["result"])
+    line = ""
+    for token in movetext:
+        if len(line) + len(token) >= 80:
+            text += "\n" + line.rstrip()
+            line = ""
+        line += token + " "
+    return text + "\n" + line.rstrip() + "\n\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check legality of every move of PGN games using all processors.")
+    parser.add_argument("files", nargs="*", default=["-"], help="PGN files, - for the standard input")
+    parser.add_argument("--processes", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--chunksize", type=int, default=32, help="games sent to a worker at once")
+    parser.add_argument("--unordered", action="store_true", help="print results as soon as they are ready")
+    parser.add_argument("--annotate", default=None, help="write the valid games with rewritten SAN to this file")
+    args = parser.parse_args()
+
+    def texts():
+        for name in args.files:
+            if name == "-":
+                yield from read_game_texts(sys.stdin)
+            else:
+                with open(name, buffering=1 << 20) as file:
+                    yield from read_game_texts(file)
+
+    annotate = None
+    if args.annotate is not None:
+        annotate = open(args.annotate, "w")
+    games = 0
+    invalid = 0
+    plies = 0
+    start = time.perf_counter()
+    for number, report in validate_games(texts(), args.processes, args.chunksize, not args.unordered):
+        games += 1
+        plies += report["plies"]
+        if report["error"] is not None:
+            invalid += 1
+            print(str(number) + "\tinvalid\t" + report["error"])
+        else:
+            print(str(number) + "\tvalid\t" + str(report["plies"]) + " plies")
+            if annotate is not None:
+                annotate.write(annotated_game(report))
+    elapsed = time.perf_counter() - start
+    print(str(games) + " games, " + str(invalid) + " invalid, " + str(plies) + " plies in " + "%.3f" % elapsed +
+          "s (" + str(int(plies / max(elapsed, 1e-9))) + " plies/s)", file=sys.stderr)
+    if annotate is not None:
+        annotate.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+__author__ = 'Maksymilian Mika'
+
+import argparse
+import cProfile
+import functools
+import pstats
+import random
+import sys
+import time
+import Chess
+
+# Methods of Chess.Board that are counted while profiling is enabled.
+profiled_methods = ["possible_moves", "is_checked", "can_castle", "make_move", "recalculate_moves", "get_moves"]
+
+
+class Counter:
+    def __init__(self):
+        """
+        Statistics of one method.
+        """
+        self.calls = 0
+        self.time = 0.0
+        self.nodes = 0
+        self.cache_hits = 0
+
+
+counters = {}
+for name in profiled_methods:
+    counters[name] = Counter()
+# Original methods while they are replaced by counting ones, empty when profiling is disabled.
+originals = {}
+
+
+def counted(name, method):
+    """
+    Wrap the method (or property getter) of Chess.Board so its calls, time and generated moves are added to its counter.
+    :return: Function to put into Chess.Board in place of the method.
+    """
+    counter = counters[name]
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        cache = Chess.move_cache
+        if cache is not None:
+            hits = cache.hits
+        start = time.perf_counter()
+        result = method(self, *args, **kwargs)
+        counter.time += time.perf_counter() - start
+        counter.calls += 1
+        if name == "possible_moves" or name == "get_moves":
+            counter.nodes += len(result)
+        if cache is not None:
+            counter.cache_hits += cache.hits - hits
+        return result
+
+    return wrapper
+
+
+def enable():
+    """
+    Start counting. Until then the methods are the original ones, so profiling costs nothing.
+    """
+    if originals:
+        return
+    for name in profiled_methods:
+        method = Chess.Board.__dict__[name]
+        originals[name] = method
+        if isinstance(method, property):
+            setattr(Chess.Board, name, property(counted(name, method.fget)))
+        else:
+            setattr(Chess.Board, name, counted(name, method))
+
+
+def disable():
+    """
+    Stop counting and put the original methods back. The counters are kept.
+    """
+    for name, method in originals.items():
+        setattr(Chess.Board, name, method)
+    originals.clear()
+
+
+def reset():
+    """
+    Set all counters to zero.
+    """
+    for name in profiled_methods:
+        counters[name] = Counter()
+    # Wrappers keep the counter they were created with, so they have to be created again.
+    if originals:
+        disable()
+        enable()
+
+
+def stats():
+    """
+    :return: Dictionary from method name to dictionary with calls, time in seconds, nodes (moves returned by
+    possible_moves and get_moves) and cache_hits (positions taken from Chess.move_cache during the calls).
+    Time of a method includes the time of the profiled methods it calls.
+    """
+    result = {}
+    for name in profiled_methods:
+        counter = counters[name]
+        result[name] = {"calls": counter.calls, "time": counter.time, "nodes": counter.nodes,
+                        "cache_hits": counter.cache_hits}
+    return result
+
+
+def report():
+    """
+    :return: Table of the statistics, one method per line.
+    """
+    text = "%-18s %10s %10s %10s %10s %10s\n" % ("method", "calls", "time [s]", "us/call", "nodes", "cache hits")
+    for name, values in stats().items():
+        per_call = 0.0
+        if values["calls"]:
+            per_call = 1e6 * values["time"] / values["calls"]
+        text += "%-18s %10d %10.3f %10.2f %10d %10d\n" % (name, values["calls"], values["time"], per_call,
+                                                           values["nodes"], values["cache_hits"])
+    return text
+
+
+class Profile:
+    def __init__(self, output=None, pstats_file=None, sort="cumulative", limit=20):
+        """
+        Context manager counting the profiled methods inside the with block. Example:
+        with Profile(sys.stderr, "moves.prof"):
+            board.recalculate_moves()
+        :param output: Text file the report is written to at the end, nothing is written when not given.
+        :param pstats_file: Path where a cProfile of the block is dumped, for pstats or snakeviz. No cProfile
+        runs when not given.
+        :param sort: Order of the cProfile functions written to the output.
+        :param limit: Number of cProfile functions written to the output.
+        """
+        self.output = output
+        self.pstats_file = pstats_file
+        self.sort = sort
+        self.limit = limit
+        self.profiler = None
+        self.stats = None
+
+    def __enter__(self):
+        reset()
+        enable()
+        if self.pstats_file is not None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.profiler is not None:
+            self.profiler.disable()
+        disable()
+        self.stats = stats()
+        if self.profiler is not None:
+            self.profiler.dump_stats(self.pstats_file)
+        if self.output is not None:
+            self.output.write(report())
+            if self.profiler is not None:
+                pstats.Stats(self.profiler, stream=self.output).sort_stats(self.sort).print_stats(self.limit)
+        return False
+
+
+def random_games(games, plies, seed=0):
+    """
+    Play random games through recalculate_moves and make_move, the way the window does.
+    :return: Number of moves made.
+    """
+    generator = random.Random(seed)
+    made = 0
+    for game in range(games):
+        board = Chess.Board()
+        board.recalculate_moves()
+        for ply in range(plies):
+            if board.win is not None:
+                break
+            moves = []
+            for i in range(64):
+                moves += board.get_moves(Chess.convert_index(i))
+            board.make_move(*generator.choice(moves))
+            board.recalculate_moves()
+            made += 1
+    return made
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count calls and time of move generation in random games.")
+    parser.add_argument("--games", type=int, default=20, help="number of games")
+    parser.add_argument("--plies", type=int, default=100, help="most moves of a game")
+    parser.add_argument("--pstats", default=None, help="file for the cProfile statistics")
+    args = parser.parse_args()
+
+    with Profile(sys.stdout, args.pstats):
+        made = random_games(args.games, args.plies)
+    print(str(made) + " moves made")
+
+
+if __name__ == "__main__":
+    main()
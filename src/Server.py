@@ -0,0 +1,413 @@
+__author__ = 'Maksymilian Mika'
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import os
+import random
+import sys
+import time
+import Chess
+import Perft
+
+promotion_names = {"q": "Queen", "r": "Rook", "b": "Bishop", "n": "Knight"}
+commands = ["new", "move", "legal", "state", "end", "stats"]
+
+
+def analyse(data):
+    """
+    Calculate the legal moves and status of the position. Run in the worker processes.
+    :param data: Position packed by Board.to_bytes.
+    :return: Pair (moves, status). moves is a list of moves in coordinate notation, status is checkmate, stalemate,
+    check or normal.
+    """
+    board = Chess.Board.from_bytes(data)
+    board.recalculate_moves()
+    moves = []
+    for i in range(64):
+        for move in board.get_moves(Chess.convert_index(i)):
+            moves.append(Perft.move_name(move))
+    checked = board.king_checked
+    if not moves:
+        if checked:
+            return moves, "checkmate"
+        return moves, "stalemate"
+    if checked:
+        return moves, "check"
+    return moves, "normal"
+
+
+def analyse_batch(positions):
+    """
+    Analyse many positions in one call, so they are sent to a worker process together.
+    :param positions: List of positions packed by Board.to_bytes.
+    :return: List of results of analyse.
+    """
+    return [analyse(data) for data in positions]
+
+
+def parse_move(name):
+    """
+    Read a move written by Perft.move_name.
+    :param name: Example: e7e8q
+    :return: Move as used by Board.make_move.
+    """
+    if len(name) not in (4, 5) or name[0] not in "abcdefgh" or name[2] not in "abcdefgh" or \
+            name[1] not in "12345678" or name[3] not in "12345678" or name[4:] and name[4] not in promotion_names:
+        raise ValueError("Invalid move: " + name)
+    previous = ("abcdefgh".index(name[0]), int(name[1]) - 1)
+    next = ("abcdefgh".index(name[2]), int(name[3]) - 1)
+    if len(name) == 5:
+        return previous, next, promotion_names[name[4]]
+    return previous, next
+
+
+async def read_line(reader):
+    """
+    Read one line from the stream. A line longer than the stream limit is skipped up to its end.
+    :return: Line with the newline, None for a skipped line or an empty string at the end of the stream.
+    """
+    try:
+        return await reader.readuntil(b"\n")
+    except asyncio.IncompleteReadError as error:
+        return error.partial
+    except asyncio.LimitOverrunError as error:
+        consumed = error.consumed
+    while True:
+        await reader.read(max(consumed, 1))
+        try:
+            await reader.readuntil(b"\n")
+            return None
+        except asyncio.IncompleteReadError:
+            return b""
+        except asyncio.LimitOverrunError as error:
+            consumed = error.consumed
+
+
+class Metrics:
+    def __init__(self, samples=4096):
+        """
+        Latencies of the requests, by command.
+        :param samples: Number of latest latencies of every command kept for the percentiles.
+        """
+        self.samples = samples
+        self.latencies = {}
+        self.counts = {}
+        self.totals = {}
+        self.maxima = {}
+
+    def record(self, command, seconds):
+        """
+        Add the latency of one request.
+        """
+        if command not in self.latencies:
+            self.latencies[command] = collections.deque(maxlen=self.samples)
+            self.counts[command] = 0
+            self.totals[command] = 0.0
+            self.maxima[command] = 0.0
+        self.latencies[command].append(seconds)
+        self.counts[command] += 1
+        self.totals[command] += seconds
+        self.maxima[command] = max(self.maxima[command], seconds)
+
+    def summary(self):
+        """
+        :return: Dictionary from command to dictionary with count and the mean, p50, p99 and max latencies in
+        milliseconds. Percentiles are taken from the latest samples.
+        """
+        result = {}
+        for command, latencies in self.latencies.items():
+            ordered = sorted(latencies)
+            result[command] = {"count": self.counts[command],
+                               "mean": 1000 * self.totals[command] / self.counts[command],
+                               "p50": 1000 * ordered[len(ordered) // 2],
+                               "p99": 1000 * ordered[min(len(ordered) - 1, len(ordered) * 99 // 100)],
+                               "max": 1000 * self.maxima[command]}
+        return result
+
+    def report(self):
+        """
+        :return: One line describing the latencies. Example: move count=10 mean=0.512ms ...
+        """
+        parts = []
+        for command, values in sorted(self.summary().items()):
+            part = command + " count=" + str(values["count"])
+            for name in ("mean", "p50", "p99", "max"):
+                part += " " + name + "=" + "%.3f" % values[name] + "ms"
+            parts.append(part)
+        return "; ".join(parts)
+
+
+class Game:
+    def __init__(self, board):
+        """
+        Game hosted by the server.
+        :param board: Current position.
+        """
+        self.board = board
+        # Future of analyse for the current position, None until someone asks for it.
+        self.analysis = None
+
+
+class Server:
+    def __init__(self, processes=None):
+        """
+        Host games for clients speaking a line protocol. Every request is one line, a command and its arguments
+        separated by spaces, and gets one line in reply starting with ok or error:
+        new [fen] - start a game, replies with its id.
+        move <id> <move> - make a move in coordinate notation (e2e4, e7e8q, castles as e1h1), replies with the fen.
+        legal <id> - replies with the legal moves.
+        state <id> - replies with checkmate, stalemate, check or normal and the fen.
+        end <id> - forget the game.
+        stats - replies with the latencies of the requests.
+        Move calculation runs in a pool of processes, so the connections are served while it runs. Positions asked
+        for at about the same time are sent to the processes in batches.
+        :param processes: Number of worker processes, all processors when not given.
+        """
+        self.games = {}
+        self.next_id = 1
+        self.processes = processes or os.cpu_count()
+        self.pool = concurrent.futures.ProcessPoolExecutor(self.processes)
+        self.pending = []
+        self.metrics = Metrics()
+
+    def analyse_later(self, data):
+        """
+        Queue the position for the next batch.
+        :param data: Position packed by Board.to_bytes.
+        :return: asyncio.Future of the result of analyse.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((data, future))
+        if len(self.pending) == 1:
+            loop.call_soon(self.send_batches)
+        return future
+
+    def send_batches(self):
+        """
+        Split the queued positions between the worker processes.
+        """
+        pending = self.pending
+        self.pending = []
+        size = min(-(-len(pending) // self.processes), 256)
+        for start in range(0, len(pending), size):
+            batch = pending[start:start + size]
+            positions = [data for data, future in batch]
+            done = asyncio.get_running_loop().run_in_executor(self.pool, analyse_batch, positions)
+            done.add_done_callback(functools.partial(self.deliver, batch))
+
+    def deliver(self, batch, done):
+        """
+        Hand the results of a finished batch to the waiting requests.
+        """
+        for index, (data, future) in enumerate(batch):
+            if future.cancelled():
+                continue
+            if done.exception() is not None:
+                future.set_exception(done.exception())
+            else:
+                future.set_result(done.result()[index])
+
+    async def analysis(self, game):
+        """
+        Analyse the current position of the game, at most once per position.
+        :return: Pair as from analyse.
+        """
+        while True:
+            future = game.analysis
+            if future is None:
+                future = self.analyse_later(game.board.to_bytes())
+                game.analysis = future
+            try:
+                moves, status = await future
+            except BaseException:
+                # Forget the failed analysis so that the next request on this game tries again.
+                if game.analysis is future:
+                    game.analysis = None
+                raise
+            # Another client could have moved while waiting.
+            if game.analysis is future:
+                return moves, status
+
+    def game(self, arguments):
+        """
+        Find the game with the id given as the first argument.
+        """
+        if not arguments or arguments[0] not in self.games:
+            raise ValueError("Unknown game")
+        return self.games[arguments[0]]
+
+    async def execute(self, command, arguments):
+        """
+        Carry out one request.
+        :return: Reply without the ending newline.
+        """
+        if command == "new":
+            board = Chess.Board(" ".join(arguments) or None)
+            game_id = str(self.next_id)
+            self.next_id += 1
+            self.games[game_id] = Game(board)
+            return "ok " + game_id
+        if command == "move":
+            game = self.game(arguments)
+            if len(arguments) != 2:
+                raise ValueError("Expected: move <id> <move>")
+            move = parse_move(arguments[1])
+            moves, status = await self.analysis(game)
+            if arguments[1] not in moves:
+                raise ValueError("Illegal move: " + arguments[1])
+            game.board.make_move(*move)
+            game.analysis = None
+            return "ok " + game.board.fen()
+        if command == "legal":
+            moves, status = await self.analysis(self.game(arguments))
+            return " ".join(["ok"] + moves)
+        if command == "state":
+            game = self.game(arguments)
+            moves, status = await self.analysis(game)
+            return "ok " + status + " " + game.board.fen()
+        if command == "end":
+            self.game(arguments)
+            del self.games[arguments[0]]
+            return "ok"
+        if command == "stats":
+            return "ok " + self.metrics.report()
+        raise ValueError("Unknown command: " + command)
+
+    async def handle(self, reader, writer):
+        """
+        Serve one connection until the client closes it.
+        """
+        try:
+            while True:
+                line = await read_line(reader)
+                if line == b"":
+                    break
+                start = time.perf_counter()
+                if line is None:
+                    words = ["invalid"]
+                    reply = "error Line too long"
+                else:
+                    words = line.decode("ascii", "replace").split()
+                    if not words:
+                        continue
+                    try:
+                        reply = await self.execute(words[0], words[1:])
+                    except ValueError as error:
+                        reply = "error " + str(error)
+                    except Exception as error:
+                        reply = "error " + type(error).__name__ + ": " + str(error)
+                writer.write((reply + "\n").encode("ascii", "replace"))
+                await writer.drain()
+                if words[0] in commands:
+                    self.metrics.record(words[0], time.perf_counter() - start)
+                else:
+                    self.metrics.record("invalid", time.perf_counter() - start)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765, path=None):
+        """
+        Accept connections until cancelled.
+        :param path: Path of a Unix socket to listen on instead of the TCP port.
+        """
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path, limit=1 << 16)
+        else:
+            server = await asyncio.start_server(self.handle, host, port, limit=1 << 16)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+        self.pool.shutdown()
+
+
+async def play_client(connect, plies, seed):
+    """
+    Client stand-in playing random legal moves of one game.
+    :param connect: Coroutine function opening a connection, returning pair (reader, writer).
+    :param plies: Number of moves to play unless the game ends earlier.
+    :return: List of latencies of its requests in seconds.
+    """
+    generator = random.Random(seed)
+    reader, writer = await connect()
+    latencies = []
+
+    async def request(line):
+        start = time.perf_counter()
+        writer.write((line + "\n").encode("ascii"))
+        reply = (await reader.readline()).decode("ascii").split()
+        latencies.append(time.perf_counter() - start)
+        if not reply or reply[0] != "ok":
+            raise ValueError(line + ": " + " ".join(reply))
+        return reply[1:]
+
+    game_id = (await request("new"))[0]
+    for ply in range(plies):
+        moves = await request("legal " + game_id)
+        if not moves:
+            break
+        await request("move " + game_id + " " + generator.choice(moves))
+    await request("end " + game_id)
+    writer.close()
+    await writer.wait_closed()
+    return latencies
+
+
+async def load(connect, clients, plies, seed=0):
+    """
+    Run many client stand-ins at once against a running server and print the latencies they saw.
+    """
+    start = time.perf_counter()
+    results = await asyncio.gather(*[play_client(connect, plies, seed + i) for i in range(clients)])
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for result in results for latency in result)
+    print(str(clients) + " clients, " + str(len(latencies)) + " requests in " + "%.3f" % elapsed + "s (" +
+          str(int(len(latencies) / max(elapsed, 1e-9))) + " requests/s), p50=" +
+          "%.3f" % (1000 * latencies[len(latencies) // 2]) + "ms p99=" +
+          "%.3f" % (1000 * latencies[len(latencies) * 99 // 100]) + "ms")
+    reader, writer = await connect()
+    writer.write(b"stats\n")
+    print("server: " + (await reader.readline()).decode("ascii").strip()[3:])
+    writer.close()
+    await writer.wait_closed()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host chess games over a socket, or load test a running server.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on or connect to")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port")
+    parser.add_argument("--unix", default=None, help="path of a Unix socket used instead of the TCP port")
+    parser.add_argument("--processes", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--clients", type=int, default=0,
+                        help="instead of serving, play this many random games against a running server")
+    parser.add_argument("--plies", type=int, default=40, help="moves played by every client")
+    args = parser.parse_args()
+
+    if args.clients:
+        if args.unix is not None:
+            connect = functools.partial(asyncio.open_unix_connection, args.unix)
+        else:
+            connect = functools.partial(asyncio.open_connection, args.host, args.port)
+        asyncio.run(load(connect, args.clients, args.plies))
+        return
+    server = Server(args.processes)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(server.metrics.report(), file=sys.stderr)
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
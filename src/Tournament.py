@@ -0,0 +1,206 @@
+__author__ = 'Maksymilian Mika'
+
+import argparse
+import json
+import multiprocessing
+import random
+import sys
+import time
+import Chess
+import Engine
+import Perft
+
+policies = ["random", "greedy", "search"]
+
+
+def parse_policy(text):
+    """
+    Read a policy description.
+    :param text: Policy name, for search followed by its limits. Examples: random, greedy, search:depth=2,nodes=5000
+    :return: Pair (name, Engine.Limits or None).
+    """
+    name, _, options = text.partition(":")
+    if name not in policies:
+        raise ValueError("Unknown policy: " + text)
+    if name != "search":
+        return name, None
+    limits = Engine.Limits()
+    for option in options.split(","):
+        if not option:
+            continue
+        key, _, value = option.partition("=")
+        if key == "time":
+            limits.time = float(value)
+        elif key == "nodes":
+            limits.nodes = int(value)
+        elif key == "depth":
+            limits.depth = int(value)
+        else:
+            raise ValueError("Unknown search limit: " + option)
+    if limits.time is None and limits.nodes is None and limits.depth is None:
+        limits.depth = 2
+    return name, limits
+
+
+def material_gain(board, code):
+    """
+    Material won by the move at once: the captured piece and what a pawn promotes to.
+    :param code: Encoded move.
+    :return: Gain in centipawns.
+    """
+    gain = 0
+    target = board.table[code >> 6 & 63]
+    if target is not None and target.color != board.turn:
+        gain += Engine.piece_values[target.index % 6]
+    flags = code >> 12
+    if flags == Chess.en_passant_flag:
+        gain += Engine.piece_values[0]
+    elif flags & Chess.promotion_flag:
+        gain += Engine.piece_values[Chess.pieces[(flags & 3) + 1].index] - Engine.piece_values[0]
+    return gain
+
+
+def choose_move(policy, board, buffer, count, generator, engine):
+    """
+    Pick the move of the player whose turn it is.
+    :param policy: Pair from parse_policy.
+    :param buffer: Move buffer with the count legal moves of the position.
+    :return: Pair (encoded move, nodes). Nodes are the searched positions, or the moves looked at without a search.
+    """
+    name, limits = policy
+    if name == "random":
+        return buffer[generator.randrange(count)], 1
+    if name == "greedy":
+        best = []
+        best_gain = -1
+        for i in range(count):
+            gain = material_gain(board, buffer[i])
+            if gain > best_gain:
+                best = [buffer[i]]
+                best_gain = gain
+            elif gain == best_gain:
+                best.append(buffer[i])
+        return generator.choice(best), count
+    result = engine.search(board, limits)
+    if result.move is None:
+        # The limits ended the search before the first move was searched.
+        return buffer[0], result.nodes
+    return board.move_code(result.move), result.nodes
+
+
+def play_game(task):
+    """
+    Play one game between two policies.
+    :param task: Tuple (game number, white policy text, black policy text, seed, most plies).
+    :return: Dictionary with the game number, policies, result, reason, plies, moves in coordinate notation, nodes
+    and time of both sides in seconds.
+    """
+    number, white, black, seed, max_plies = task
+    players = {"White": parse_policy(white), "Black": parse_policy(black)}
+    generator = random.Random(seed)
+    engine = None
+    if players["White"][0] == "search" or players["Black"][0] == "search":
+        engine = Engine.Engine(table_size=1 << 16)
+    board = Chess.Board()
+    buffer = Chess.move_buffer()
+    seen = {board.hash: 1}
+    moves = []
+    nodes = {"White": 0, "Black": 0}
+    spent = {"White": 0.0, "Black": 0.0}
+    result = "1/2-1/2"
+    reason = "move limit"
+    while True:
+        count = board.generate_moves(buffer)
+        if count == 0:
+            if board.king_checked:
+                if board.turn == "White":
+                    result = "0-1"
+                else:
+                    result = "1-0"
+                reason = "checkmate"
+            else:
+                reason = "stalemate"
+            break
+        if seen[board.hash] >= 3:
+            reason = "repetition"
+            break
+        if len(moves) >= max_plies:
+            break
+        turn = board.turn
+        start = time.perf_counter()
+        code, searched = choose_move(players[turn], board, buffer, count, generator, engine)
+        spent[turn] += time.perf_counter() - start
+        nodes[turn] += searched
+        moves.append(Perft.move_name(Chess.decode_move(code)))
+        board.make_encoded_move(code)
+        seen[board.hash] = seen.get(board.hash, 0) + 1
+    return {"game": number, "white": white, "black": black, "result": result, "reason": reason,
+            "plies": len(moves), "moves": moves, "nodes": nodes, "time": spent}
+
+
+def run_tournament(games, first, second, processes=None, max_plies=300, seed=0):
+    """
+    Play games between two policies in a pool of processes. Colors change every game, the first policy starts
+    with white.
+    :param games: Number of games.
+    :param first: Policy text of the first player.
+    :param second: Policy text of the second player.
+    :param processes: Number of worker processes, all processors when not given.
+    :return: Generator of results of play_game, in the order the games finish.
+    """
+    parse_policy(first)
+    parse_policy(second)
+    tasks = []
+    for number in range(games):
+        if number % 2 == 0:
+            tasks.append((number, first, second, seed + number, max_plies))
+        else:
+            tasks.append((number, second, first, seed + number, max_plies))
+    with multiprocessing.Pool(processes) as pool:
+        yield from pool.imap_unordered(play_game, tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play games between move choosing policies without a window.")
+    parser.add_argument("--games", type=int, default=10, help="number of games")
+    parser.add_argument("--first", default="search:depth=2",
+                        help="policy of the first player: random, greedy or search with limits "
+                             "(search:depth=2, search:nodes=5000, search:time=0.1)")
+    parser.add_argument("--second", default="random", help="policy of the second player")
+    parser.add_argument("--processes", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--max-plies", type=int, default=300, help="games this long are drawn")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random choices")
+    parser.add_argument("--output", default="-", help="JSONL file for the results, - for the standard output")
+    args = parser.parse_args()
+
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    points = {args.first: 0.0, args.second: 0.0}
+    plies = 0
+    nodes = 0
+    played = 0
+    start = time.perf_counter()
+    for game in run_tournament(args.games, args.first, args.second, args.processes, args.max_plies, args.seed):
+        output.write(json.dumps(game) + "\n")
+        output.flush()
+        played += 1
+        plies += game["plies"]
+        nodes += game["nodes"]["White"] + game["nodes"]["Black"]
+        if game["result"] == "1-0":
+            points[game["white"]] += 1
+        elif game["result"] == "0-1":
+            points[game["black"]] += 1
+        else:
+            points[game["white"]] += 0.5
+            points[game["black"]] += 0.5
+    elapsed = time.perf_counter() - start
+    if output is not sys.stdout:
+        output.close()
+    print(args.first + " " + str(points[args.first]) + " : " + str(points[args.second]) + " " + args.second,
+          file=sys.stderr)
+    print(str(played) + " games, " + str(plies) + " plies, " + str(nodes) + " nodes in " + "%.3f" % elapsed + "s (" +
+          "%.2f" % (played / max(elapsed, 1e-9)) + " games/s, " + str(int(plies / max(elapsed, 1e-9))) + " plies/s)",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+__author__ = 'Maksymilian Mika'
+
+import concurrent.futures
+import queue
+import threading
+import Chess
+import Engine
+
+
+def calculate_moves(board):
+    """
+    Calculate the moves of every field of the position.
+    :param board: Copy of the board, used only by the worker thread.
+    :return: Pair (moves, win). moves is a list with the moves of every field, as from Board.get_moves, and win
+    is set as by Board.recalculate_moves.
+    """
+    board.recalculate_moves()
+    moves = []
+    for i in range(64):
+        moves.append(board.get_moves(Chess.convert_index(i)))
+    return moves, board.win
+
+
+class Worker:
+    def __init__(self, notify=None, book=None):
+        """
+        Background thread calculating moves and computer replies, so the thread handling the window never waits
+        for them. Jobs are run one at a time in the order they were given. Only the results of jobs given after the
+        last cancel are handed out.
+        :param notify: Called from the background thread every time a result is ready. Example: a function posting
+        a pygame event that wakes the main loop.
+        :param book: Opening book (Book.Book) the replies are taken from while the position is in it.
+        """
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.engine = Engine.Engine()
+        self.book = book
+        self.results = queue.Queue()
+        self.notify = notify
+        self.generation = 0
+        self.jobs = []
+        self.stop = threading.Event()
+
+    def submit(self, kind, function, *args):
+        """
+        Run the function in the background thread. When the function raises, the result has the kind error and
+        the exception as the result.
+        :param kind: Name returned together with the result. Example: moves
+        """
+        generation = self.generation
+        self.jobs = [job for job in self.jobs if not job.done()]
+        future = self.executor.submit(function, *args)
+        self.jobs.append(future)
+
+        def done(future):
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                self.results.put((generation, "error", future.exception()))
+            else:
+                self.results.put((generation, kind, future.result()))
+            if self.notify is not None:
+                self.notify()
+
+        future.add_done_callback(done)
+
+    def legal_moves(self, board):
+        """
+        Calculate the moves of the board in the background. The result is a pair as from calculate_moves.
+        """
+        self.submit("moves", calculate_moves, board.copy())
+
+    def reply(self, board, limits=None):
+        """
+        Search the best move of the board in the background. The result is Engine.SearchResult.
+        :param limits: Limits of the search.
+        """
+        self.submit("reply", self.best_move, board.copy(), limits, self.stop)
+
+    def best_move(self, board, limits, stop):
+        """
+        Take the move from the opening book, or search it when the position is not there.
+        :return: Engine.SearchResult.
+        """
+        if self.book is not None:
+            move = self.book.choose(board)
+            if move is not None:
+                result = Engine.SearchResult()
+                result.move = move
+                result.pv = [move]
+                return result
+        return self.engine.search(board, limits, None, stop)
+
+    def cancel(self):
+        """
+        Forget all given jobs. Jobs not started yet are dropped and a running search is stopped.
+        """
+        self.generation += 1
+        for future in self.jobs:
+            future.cancel()
+        self.jobs = []
+        self.stop.set()
+        # The event of the stopped search is kept by it, later searches get a new one.
+        self.stop = threading.Event()
+
+    def poll(self):
+        """
+        Take the finished results without waiting.
+        :return: List of pairs (kind, result) of jobs given after the last cancel.
+        """
+        results = []
+        while True:
+            try:
+                generation, kind, result = self.results.get_nowait()
+            except queue.Empty:
+                return results
+            if generation == self.generation:
+                results.append((kind, result))
+
+    def close(self):
+        """
+        Cancel the jobs and wait for the background thread to end.
+        """
+        self.cancel()
+        self.executor.shutdown()